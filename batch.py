@@ -0,0 +1,281 @@
+# command line entry point running ImageProcessing operations over many image files without the GUI
+# example:
+#   python batch.py "scans/*.png" "out/*_edited.jpg" --recipe equalize,gamma=0.8,blur=3 --jobs 8
+# Qt and matplotlib are never imported so that worker processes start quickly
+
+import argparse  # used for parsing command line arguments
+import glob  # used for expanding the input pattern
+import os  # used for handling file paths
+import shutil  # used for removing the work directory of a worker
+import sys  # used for exit codes and reporting
+import time  # used for measuring throughput
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait  # used for processing files in parallel
+
+import cv2  # used for reading/writing images and colorspace conversion
+
+from image_processing import ImageProcessing  # used for the image processing operations
+from pipeline import Pipeline  # used for computing chained operations in a single pass
+from streaming import StreamingProcessor  # used for images too large to be held in memory
+from tiling import BACKENDS  # used for checking backend names
+
+img_object = None  # ImageProcessing object of the worker process, created once by init_worker
+
+
+# recipe step names => (ImageProcessing method, converting the step value to the method arguments)
+# blur value is the slider value of the GUI (window size 2 * value + 1), sharpen value is the sharpen constant
+# and clahe value is the clip limit of adaptive equalization (e.g. 2)
+RECIPE_STEPS = {
+    'equalize': ('histogram_equalization', None),
+    'gamma': ('gamma_correction', lambda value: (float(value),)),
+    'log': ('log_transform', None),
+    'blur': ('blur', lambda value: (2 * int(value) + 1,)),
+    'sharpen': ('sharp', lambda value: (float(value),)),
+    'edges': ('edge_detection', None),
+    'clahe': ('adaptive_histogram_equalization', lambda value: (float(value),)),
+}
+
+
+# parsing a recipe like "equalize,gamma=0.8,blur=3" into a list of (operation, args) in the order given
+def parse_recipe(recipe):
+
+    operations = []
+
+    for step in recipe.split(','):
+        name, _, value = step.strip().partition('=')
+
+        if name not in RECIPE_STEPS:
+            raise ValueError("unknown recipe step '%s', expected one of %s" % (name, ', '.join(RECIPE_STEPS)))
+
+        operation, convert = RECIPE_STEPS[name]
+
+        if convert is None:
+            if value:
+                raise ValueError("recipe step '%s' takes no value" % name)
+            operations.append((operation, ()))
+        elif not value:
+            raise ValueError("recipe step '%s' needs a value, e.g. %s=1" % (name, name))
+        else:
+            operations.append((operation, convert(value)))
+
+    return operations
+
+
+# returning the directory an input pattern is matched from, the part of the pattern before the first wildcard
+# (e.g. "scans" for "scans/**/*.png")
+def pattern_root(pattern):
+
+    parts = []
+    for part in pattern.replace(os.sep, '/').split('/'):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+
+    return '/'.join(parts) or os.curdir
+
+
+# computing the output path of input_path, output is a directory or a pattern where * is replaced by the
+# input file name without extension (e.g. "out/*_edited.png")
+# in an output directory the path of the input below root (the pattern root) is kept, so that inputs of the same
+# name in different subdirectories of a recursive pattern do not overwrite each other
+def output_path(input_path, output, root=None):
+
+    name = os.path.splitext(os.path.basename(input_path))[0]
+
+    if '*' in output:
+        return output.replace('*', name)
+
+    if root is not None:
+        return os.path.join(output, os.path.relpath(input_path, root))
+
+    return os.path.join(output, os.path.basename(input_path))
+
+
+# creating the ImageProcessing object of a worker process, one thread per process as the processes
+# already use all cores, backend is the tile backend of the filters (see tiling.make_scheduler)
+def init_worker(threads, backend='thread'):
+    global img_object
+    img_object = ImageProcessing(threads, backend)
+
+
+# running operations on the V channel of the image at input_path and writing it to destination_path,
+# called in a worker process, returns no. of pixels processed
+# the image is written to a temporary file first and renamed, so an interrupted run never leaves a partial
+# output which a resumed run would skip
+def process_file(input_path, destination_path, operations, work_dir=None):
+
+    base, extension = os.path.splitext(destination_path)
+    partial_path = base + '.partial' + extension  # keeping the extension so that cv2 chooses the same format
+
+    if work_dir is not None:
+        work_dir = os.path.join(work_dir, 'worker-%d' % os.getpid())
+
+    try:
+        if work_dir is not None:
+            # images are processed strip by strip through memory mapped files of the worker process, which bounds
+            # memory only for .npy inputs/outputs as other formats are decoded/encoded whole
+            os.makedirs(work_dir, exist_ok=True)
+            image_shape = StreamingProcessor(img_object).process_file(input_path, partial_path, operations, work_dir)
+        else:
+            image = cv2.imread(input_path, 1)
+            if image is None:
+                raise IOError("could not read image '%s'" % input_path)
+
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+            # chained operations are fused into as few passes over the image as possible
+            image[:, :, 2] = Pipeline(operations, img_object).run(image[:, :, 2])
+
+            if not cv2.imwrite(partial_path, cv2.cvtColor(image, cv2.COLOR_HSV2BGR)):
+                raise IOError("could not write image '%s'" % destination_path)
+            image_shape = image.shape
+
+        os.replace(partial_path, destination_path)
+    finally:
+        # a failed file leaves neither a partial output nor the files of its passes behind
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return image_shape[0] * image_shape[1]
+
+
+# class processing every file matching the input pattern with a process pool
+# at most max_in_flight files are submitted at a time so that memory does not grow with the no. of files
+class BatchProcessor(object):
+
+    report_interval = 5.0  # seconds between progress reports
+
+    def __init__(self, operations, jobs=None, threads=1, max_in_flight=None, overwrite=False, work_dir=None,
+                 stream=sys.stderr, backend='thread'):
+        self.operations = operations  # list of (operation, args)
+        self.jobs = jobs or os.cpu_count() or 1  # no. of worker processes
+        self.threads = threads  # no. of threads used by each worker process
+        self.backend = backend  # tile backend of each worker process, e.g. 'process' for one job with many cores
+        self.max_in_flight = max_in_flight or 2 * self.jobs  # keeping each worker busy while results are collected
+        self.overwrite = overwrite  # processing files whose output already exists
+        self.work_dir = work_dir  # directory for memory mapped strips, None processes images in memory
+        self.stream = stream  # stream for progress reports
+
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.pixels = 0
+
+    # returning the list of (input path, output path) to process, outputs which exist are skipped unless
+    # overwrite is set so that an interrupted run can be resumed, root is the directory the inputs were matched from
+    # raises ValueError when several inputs have the same output (e.g. an output pattern with the same file name
+    # in different subdirectories)
+    def tasks(self, inputs, output, root=None):
+
+        tasks = []
+        destinations = {}  # output path => input path written to it
+
+        for input_path in inputs:
+            destination_path = output_path(input_path, output, root)
+
+            if destination_path in destinations:
+                raise ValueError("'%s' and '%s' would both be written to '%s'" % (
+                    destinations[destination_path], input_path, destination_path))
+            destinations[destination_path] = input_path
+
+            if not self.overwrite and os.path.exists(destination_path):
+                self.skipped += 1
+                continue
+
+            tasks.append((input_path, destination_path))
+
+        return tasks
+
+    def report(self, start, final=False):
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        self.stream.write('%s%d processed, %d skipped, %d failed in %.1f s (%.2f images/s, %.1f MP/s)\n' % (
+            'done: ' if final else '', self.processed, self.skipped, self.failed, elapsed,
+            self.processed / elapsed, self.pixels / elapsed / 1e6))
+        self.stream.flush()
+
+    # processing all files matching the input pattern, returns no. of failed files
+    def run(self, pattern, output):
+
+        inputs = sorted(glob.glob(pattern, recursive=True))
+        tasks = self.tasks(inputs, output, pattern_root(pattern))
+
+        for directory in set(os.path.dirname(destination_path) for _, destination_path in tasks):
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+        start = time.perf_counter()
+        last_report = start
+
+        with ProcessPoolExecutor(self.jobs, initializer=init_worker,
+                                 initargs=(self.threads, self.backend)) as executor:
+            pending = {}  # future => input path
+            next_task = 0
+
+            while next_task < len(tasks) or pending:
+
+                # submitting files until max_in_flight are queued or running
+                while next_task < len(tasks) and len(pending) < self.max_in_flight:
+                    input_path, destination_path = tasks[next_task]
+                    future = executor.submit(process_file, input_path, destination_path, self.operations,
+                                             self.work_dir)
+                    pending[future] = input_path
+                    next_task += 1
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    input_path = pending.pop(future)
+                    try:
+                        self.pixels += future.result()
+                        self.processed += 1
+                    except Exception as error:
+                        self.failed += 1
+                        self.stream.write('failed: %s: %s\n' % (input_path, error))
+
+                if time.perf_counter() - last_report >= self.report_interval:
+                    self.report(start)
+                    last_report = time.perf_counter()
+
+        self.report(start, final=True)
+
+        return self.failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run image editor operations on the V channel of many images.')
+    parser.add_argument('input', help='glob pattern of input images, e.g. "scans/**/*.png"')
+    parser.add_argument('output', help='output directory, or output pattern where * is replaced by the input '
+                                       'file name without extension, e.g. "out/*_edited.jpg"')
+    parser.add_argument('-r', '--recipe', required=True,
+                        help='comma separated operations applied in order: equalize, gamma=G, log, blur=N '
+                             '(window 2N+1), sharpen=C, edges, clahe=L (adaptive equalization, clip limit L)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='no. of worker processes (default: cores)')
+    parser.add_argument('--threads', type=int, default=1, help='no. of threads in each worker process')
+    parser.add_argument('--backend', choices=BACKENDS, default='thread',
+                        help='how the filters of each worker process run their strips, with --threads workers')
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help='no. of files queued or being processed at a time (default: 2 x jobs)')
+    parser.add_argument('--overwrite', action='store_true', help='process files whose output already exists')
+    parser.add_argument('--work-dir', default=None,
+                        help='process images strip by strip through memory mapped files in this directory, peak '
+                             'memory is bounded only for .npy inputs and outputs, other formats are decoded and '
+                             'encoded whole by cv2 and only add disk traffic')
+    args = parser.parse_args(argv)
+
+    try:
+        operations = parse_recipe(args.recipe)
+    except ValueError as error:
+        parser.error(str(error))
+
+    processor = BatchProcessor(operations, args.jobs, args.threads, args.max_in_flight, args.overwrite,
+                               args.work_dir, backend=args.backend)
+
+    try:
+        return 1 if processor.run(args.input, args.output) else 0
+    except ValueError as error:
+        parser.error(str(error))  # inputs with the same output, found before any file is processed
+
+
+if __name__ == '__main__':
+    sys.exit(main())
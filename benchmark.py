@@ -0,0 +1,257 @@
+# command line benchmark of every ImageProcessing operation across image sizes
+# example:
+#   python benchmark.py --sizes vga,fhd,4k --output results.json
+#   python benchmark.py --output new.json --baseline results.json --threshold 0.10
+#   python benchmark.py --backends inline,thread,process --workers 8 --radii 1,10
+# wall time, throughput and peak memory of each operation are written as JSON, and compared with a baseline
+# file when one is passed, the exit code is 1 when any operation is slower than the baseline by more than
+# threshold
+
+import argparse  # used for parsing command line arguments
+import json  # used for writing and reading results
+import os  # used for finding no. of cpu cores
+import platform  # used for recording the machine of the results
+import sys  # used for exit codes and reporting
+import time  # used for measuring wall time
+import tracemalloc  # used for measuring peak memory
+
+import cv2  # used for the OpenCV reference timings
+import numpy as np  # used for handling array operations
+
+from image_processing import ImageProcessing  # used for the image processing operations
+from tiling import BACKENDS  # used for checking backend names
+
+
+# benchmarked image sizes as name => (width, height), from VGA to 50 megapixels
+SIZES = {
+    'vga': (640, 480),
+    'hd': (1280, 720),
+    'fhd': (1920, 1080),
+    '4k': (3840, 2160),
+    '12mp': (4000, 3000),
+    '24mp': (6000, 4000),
+    '50mp': (8688, 5792),
+}
+
+SLIDER_MAX = 10  # largest value of the blur slider of the GUI (range 0 to 10 set in ui.py)
+
+
+# class timing the operations of an ImageProcessing object on synthetic images
+class Benchmark(object):
+
+    repeat = 3  # no. of timed runs of each operation, the median is reported
+
+    def __init__(self, img_object=None, repeat=None, opencv=False, stream=sys.stderr, backend='thread'):
+        self.img_object = img_object or ImageProcessing()
+        self.backend = backend  # backend of the tile scheduler of img_object, recorded with the results
+        if repeat:
+            self.repeat = repeat
+        self.opencv = opencv  # also timing the equivalent OpenCV primitive
+        self.stream = stream  # stream for progress reports
+
+    # returning the list of (operation, parameter, function, OpenCV reference function) to benchmark,
+    # blur is run for every slider value in radii (window size 2 * radius + 1)
+    def cases(self, radii):
+
+        ip = self.img_object
+        laplacian = np.array([[1, 1, 1], [1, -8, 1], [1, 1, 1]], dtype=np.float32)
+        gamma_lut = ip.point_lut('gamma_correction', None, 0.8)
+        log_lut = ip.point_lut('log_transform', None)
+
+        cases = [
+            ('histogram_equalization', None, ip.histogram_equalization, cv2.equalizeHist),
+            ('gamma_correction', 0.8, lambda image: ip.gamma_correction(image, 0.8),
+             lambda image: cv2.LUT(image, gamma_lut)),
+            ('log_transform', None, ip.log_transform, lambda image: cv2.LUT(image, log_lut)),
+            ('sharp', 0.5, lambda image: ip.sharp(image, 0.5),
+             lambda image: cv2.addWeighted(image, 1.0, cv2.filter2D(image, cv2.CV_32F, laplacian,
+                                                                    borderType=cv2.BORDER_CONSTANT), -0.5, 0,
+                                           dtype=cv2.CV_8U)),
+            ('edge_detection', None, ip.edge_detection,
+             lambda image: cv2.filter2D(image, cv2.CV_8U, laplacian, borderType=cv2.BORDER_CONSTANT)),
+            ('adaptive_histogram_equalization', 2.0, lambda image: ip.adaptive_histogram_equalization(image, 2.0),
+             cv2.createCLAHE(2.0, (8, 8)).apply),
+        ]
+
+        for radius in radii:
+            window_size = 2 * radius + 1
+            cases.append(('blur', radius, lambda image, window_size=window_size: ip.blur(image, window_size),
+                          lambda image, window_size=window_size: cv2.blur(image, (window_size, window_size),
+                                                                          borderType=cv2.BORDER_CONSTANT)))
+
+        return cases
+
+    # returning a synthetic 8 bit image of the size passed, smooth enough to have a realistic histogram
+    def image(self, width, height):
+
+        rng = np.random.default_rng(0)
+        coarse = rng.integers(0, 256, (height // 16 + 1, width // 16 + 1), dtype=np.uint8)
+        image = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_LINEAR)
+
+        return image + rng.integers(0, 8, image.shape, dtype=np.uint8)  # adding noise on the smooth image
+
+    # running function on image once under tracemalloc and repeat times timed
+    # returns (median seconds, min seconds, peak bytes allocated during the run)
+    def measure(self, function, image):
+
+        # first run also warms up caches, thread pool and lookup tables
+        tracemalloc.start()
+        function(image)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        times = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            function(image)
+            times.append(time.perf_counter() - start)
+
+        return float(np.median(times)), min(times), peak
+
+    # running all cases on every size in sizes, returns the list of result records
+    def run(self, sizes, radii):
+
+        results = []
+
+        for size in sizes:
+            width, height = SIZES[size]
+            image = self.image(width, height)
+            megapixels = width * height / 1e6
+
+            for operation, parameter, function, reference in self.cases(radii):
+                seconds, min_seconds, peak = self.measure(function, image)
+
+                record = {
+                    'operation': operation, 'parameter': parameter, 'size': size, 'backend': self.backend,
+                    'width': width, 'height': height, 'seconds': seconds, 'min_seconds': min_seconds,
+                    'mp_per_s': megapixels / seconds, 'peak_bytes': peak,
+                }
+
+                if self.opencv:
+                    record['opencv_seconds'] = self.measure(reference, image)[0]
+                    record['opencv_ratio'] = seconds / record['opencv_seconds']  # times slower than OpenCV
+
+                results.append(record)
+                self.stream.write('%-31s %-6s %-5s %-7s %9.2f ms %9.1f MP/s %9.1f MB peak%s\n' % (
+                    operation, '' if parameter is None else parameter, size, self.backend, seconds * 1e3,
+                    record['mp_per_s'],
+                    peak / 2 ** 20, ' %6.1fx OpenCV' % record['opencv_ratio'] if self.opencv else ''))
+                self.stream.flush()
+
+        return results
+
+
+# key matching a result record with the same record of another run, records of runs before backends were
+# recorded are threaded runs
+def record_key(record):
+    return record['operation'], record['parameter'], record['size'], record.get('backend', 'thread')
+
+
+# returning the list of (operation, parameter, size, fastest backend, {backend => seconds}) of every operation
+# run with more than one backend
+def fastest_backends(results):
+
+    seconds = {}  # (operation, parameter, size) => {backend => seconds}, in order of the results
+    for record in results:
+        key = record['operation'], record['parameter'], record['size']
+        seconds.setdefault(key, {})[record.get('backend', 'thread')] = record['seconds']
+
+    return [key + (min(times, key=times.get), times) for key, times in seconds.items() if len(times) > 1]
+
+
+# comparing results with baseline records, returns the list of (record, baseline record, slowdown) of the
+# operations slower than the baseline by more than threshold (e.g. 0.1 for 10 %)
+def find_regressions(results, baseline, threshold):
+
+    baseline_records = dict((record_key(record), record) for record in baseline)
+    regressions = []
+
+    for record in results:
+        previous = baseline_records.get(record_key(record))
+        if previous is None:
+            continue
+
+        slowdown = record['seconds'] / previous['seconds'] - 1
+        if slowdown > threshold:
+            regressions.append((record, previous, slowdown))
+
+    return regressions
+
+
+# parsing a comma separated list of slider radii, 'all' for every slider value
+def parse_radii(text):
+    if text == 'all':
+        return list(range(1, SLIDER_MAX + 1))
+    return [int(radius) for radius in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ImageProcessing operations across image sizes.')
+    parser.add_argument('--sizes', default=','.join(SIZES),
+                        help='comma separated sizes out of %s (default: all)' % ', '.join(SIZES))
+    parser.add_argument('--radii', default='all',
+                        help="comma separated blur slider values, or 'all' for 1 to %d (default)" % SLIDER_MAX)
+    parser.add_argument('--repeat', type=int, default=None, help='no. of timed runs of each operation')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='no. of threads (or processes) used by the operations')
+    parser.add_argument('--backends', default='thread',
+                        help='comma separated tile backends out of %s to compare (default: thread)' %
+                             ', '.join(BACKENDS))
+    parser.add_argument('--opencv', action='store_true', help='also time the equivalent OpenCV primitives')
+    parser.add_argument('-o', '--output', default=None, help='JSON file for the results')
+    parser.add_argument('--baseline', default=None, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='slowdown over the baseline reported as a regression (default: 0.10 i.e. 10 %%)')
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes.split(',')
+    for size in sizes:
+        if size not in SIZES:
+            parser.error("unknown size '%s', expected one of %s" % (size, ', '.join(SIZES)))
+
+    backends = args.backends.split(',')
+    for backend in backends:
+        if backend not in BACKENDS:
+            parser.error("unknown backend '%s', expected one of %s" % (backend, ', '.join(BACKENDS)))
+
+    results = []
+    for backend in backends:
+        benchmark = Benchmark(ImageProcessing(args.workers, backend), args.repeat, args.opencv, backend=backend)
+        results += benchmark.run(sizes, parse_radii(args.radii))
+        workers = benchmark.img_object.tile_scheduler.workers
+        benchmark.img_object.tile_scheduler.shutdown()
+
+    for operation, parameter, size, backend, times in fastest_backends(results):
+        sys.stderr.write('fastest: %-31s %-6s %-5s %-7s (%s)\n' % (
+            operation, '' if parameter is None else parameter, size, backend,
+            ', '.join('%s %.2f ms' % (name, seconds * 1e3) for name, seconds in times.items())))
+
+    if args.output:
+        report = {
+            'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                        'numpy': np.__version__, 'opencv': cv2.__version__, 'cpu_count': os.cpu_count(),
+                        'workers': workers},
+            'results': results,
+        }
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+        regressions = find_regressions(results, baseline, args.threshold)
+        for record, previous, slowdown in regressions:
+            sys.stderr.write('regression: %s %s %s %s %.2f ms => %.2f ms (+%.0f %%)\n' % (
+                record['operation'], '' if record['parameter'] is None else record['parameter'], record['size'],
+                record['backend'], previous['seconds'] * 1e3, record['seconds'] * 1e3, slowdown * 100))
+
+        if regressions:
+            return 1
+        sys.stderr.write('no regressions over %.0f %% against %s\n' % (args.threshold * 100, args.baseline))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
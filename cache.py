@@ -0,0 +1,68 @@
+import threading  # used for guarding the cache shared by the GUI and background threads
+from collections import OrderedDict  # used for keeping entries in least recently used order
+
+
+# class caching results of operations keyed by (source, operation, parameter) with a limit on total bytes
+# least recently used entries are evicted first, hits and misses are counted for tuning the size limit
+class ResultCache(object):
+
+    max_bytes = 512 * 1024 * 1024  # bytes of results the cache may hold
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+
+        self.entries = OrderedDict()  # key => array, most recently used last
+        self.nbytes = 0  # bytes held by all entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # returning the cached array for key (marking it most recently used), None if it is not cached
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # storing value for key and evicting least recently used entries beyond the size limit,
+    # values larger than the whole limit are not stored
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key).nbytes
+
+            if value.nbytes > self.max_bytes:
+                return
+
+            value.setflags(write=False)  # cached arrays are shared by every caller
+            self.entries[key] = value
+            self.nbytes += value.nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    # returning the cached array for key, computing it with function(*args) and storing it if not cached
+    def get_or_compute(self, key, function, *args):
+        value = self.get(key)
+        if value is None:
+            value = function(*args)
+            self.put(key, value)
+        return value
+
+    # removing all entries
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    # returning hit/miss counts and size of the cache
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'bytes': self.nbytes}
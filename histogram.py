@@ -0,0 +1,49 @@
+import numpy as np  # used for handling array operations
+
+
+# class keeping the histogram of the V channel of the image being edited up to date
+# a point operation maps the counts of each value through its lookup, so the new histogram is computed from the
+# previous one without reading any pixel; after any other edit the channel is counted again on a regular grid of
+# at most max_samples pixels and the counts are scaled to the no. of pixels of the channel
+class HistogramTracker(object):
+
+    max_samples = 1 << 18  # no. of pixels counted after an edit which is not a point operation
+
+    def __init__(self):
+        self.histogram = None  # no. of pixels of each value 0-255 (float64), None when it has to be counted again
+        self.exact = False  # histogram was counted from every pixel (or derived from such a count)
+
+    # counting the histogram of channel, every pixel is counted if exact is True
+    def count(self, channel, exact=False):
+
+        step = 1 if exact else max(1, int(np.sqrt(channel.size / self.max_samples)))
+        sample = channel[::step, ::step]
+
+        histogram = np.bincount(sample.ravel(), minlength=256).astype(np.float64)
+        if step > 1:
+            histogram *= channel.size / sample.size  # scaling the counts of the sample to the whole channel
+
+        self.histogram = histogram
+        self.exact = step == 1
+
+    # mapping the histogram through the lookup of a point operation, output value lut[v] gets the count of v
+    def apply_lut(self, lut):
+        self.histogram = np.bincount(lut, weights=self.histogram, minlength=256)
+
+    # marking the histogram as unknown, it is counted again when it is next needed
+    def invalidate(self):
+        self.histogram = None
+        self.exact = False
+
+    # updating the histogram after an edit, from lut if the edit was a point operation else marking it unknown
+    def update(self, lut=None):
+        if lut is not None and self.histogram is not None:
+            self.apply_lut(lut)
+        else:
+            self.invalidate()
+
+    # returning the histogram of channel, counting it only if it is not known
+    def get(self, channel):
+        if self.histogram is None:
+            self.count(channel)
+        return self.histogram
@@ -0,0 +1,218 @@
+import os  # used for handling spilled history files
+import shutil  # used for removing the spill directory
+import tempfile  # used for creating the spill directory
+import zlib  # used for compressing channel deltas
+
+import numpy as np  # used for handling array operations
+
+
+# class storing one step of the edit history
+# point operations with a one-to-one lookup are stored as the lookup and its inverse only, any other operation
+# is stored as the zlib compressed XOR of the V channel before and after it, the same delta takes the
+# channel from after to before (undo) and from before to after (redo)
+class HistoryEntry(object):
+
+    def __init__(self, shape, lut=None, delta=None, tag=None, step=None):
+        self.shape = shape  # shape of the V channel
+        self.lut = lut  # lookup of the point operation, None for delta entries
+        self.inverse_lut = None  # lookup undoing the point operation
+        self.delta = delta  # compressed XOR delta kept in memory
+        self.path = None  # file holding the compressed delta once it is spilled to disk
+        self.spilled_bytes = 0  # size of the spill file
+        self.tag = tag  # identifies the slider session which recorded the entry
+        self.step = step  # (operation, args) of the step, saved in project files
+
+        if lut is not None:
+            self.inverse_lut = np.empty(256, dtype=np.uint8)
+            self.inverse_lut[lut] = np.arange(256, dtype=np.uint8)
+
+    # no. of bytes of memory held by the entry
+    def nbytes(self):
+        if self.lut is not None:
+            return self.lut.nbytes + self.inverse_lut.nbytes
+        if self.delta is not None:
+            return len(self.delta)
+        return 0
+
+    # reading the compressed delta from memory or from the spill file and expanding it
+    def load_delta(self):
+        delta = self.delta
+        if delta is None:
+            with open(self.path, 'rb') as spill_file:
+                delta = spill_file.read()
+        return np.frombuffer(zlib.decompress(delta), dtype=np.uint8).reshape(self.shape)
+
+    # writing the compressed delta to a file in directory and releasing its memory
+    def spill(self, directory):
+        descriptor, self.path = tempfile.mkstemp(suffix='.delta', dir=directory)
+        with os.fdopen(descriptor, 'wb') as spill_file:
+            spill_file.write(self.delta)
+        self.spilled_bytes = len(self.delta)
+        self.delta = None
+
+    # removing the spill file of the entry
+    def release(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+        self.spilled_bytes = 0
+
+    # computing the channel before the step from the channel after it
+    def undo(self, channel):
+        if self.lut is not None:
+            return np.take(self.inverse_lut, channel)
+        return np.bitwise_xor(channel, self.load_delta())
+
+    # computing the channel after the step from the channel before it
+    def redo(self, channel):
+        if self.lut is not None:
+            return np.take(self.lut, channel)
+        return np.bitwise_xor(channel, self.load_delta())
+
+
+# class keeping the undo and redo stacks of the V channel within a memory budget
+# when the budget is exceeded the oldest deltas are moved to spill_dir, or dropped if spilling is disabled
+# spilled deltas are kept within spill_budget bytes of disk, the oldest of them are dropped beyond it
+class UndoHistory(object):
+
+    memory_budget = 256 * 1024 * 1024  # bytes of memory the history may use
+
+    spill_budget = 2 * 1024 * 1024 * 1024  # bytes of spill files the history may write
+
+    compression_level = 1  # zlib level, fastest level already shrinks smooth deltas several times
+
+    def __init__(self, memory_budget=None, spill=True, spill_dir=None, spill_budget=None):
+        if memory_budget is not None:
+            self.memory_budget = memory_budget
+        if spill_budget is not None:
+            self.spill_budget = spill_budget
+        self.spill_enabled = spill  # spilling deltas to disk instead of dropping them
+        self.spill_dir = spill_dir  # directory for spilled deltas, a temporary directory is created if None
+        self.created_spill_dir = False  # spill directory was created by the history and is removed by clear
+
+        self.undo_stack = []  # entries which can be undone, last one is undone first
+        self.redo_stack = []  # entries which can be redone, last one is redone first
+        self.dropped = False  # oldest entries of the undo stack were dropped to stay within the budget
+
+    # creating the entry for a step taking channel before to channel after, lut is passed for point operations
+    # and step is the (operation, args) which computed it
+    # this does not change the history so it can be called on a background thread
+    def make_entry(self, before, after, lut=None, tag=None, step=None):
+
+        # only one-to-one lookups can be inverted
+        if lut is not None and np.unique(lut).size == 256:
+            return HistoryEntry(before.shape, lut=lut, tag=tag, step=step)
+
+        delta = np.bitwise_xor(before, after)  # unchanged pixels give zeros which compress well
+        return HistoryEntry(before.shape, delta=zlib.compress(delta.data, self.compression_level), tag=tag,
+                            step=step)
+
+    # adding an entry on top of the undo stack, the redo stack is cleared
+    # an entry with the same tag as the top entry replaces it (e.g. blur slider moved again)
+    def push(self, entry):
+        if entry.tag is not None:
+            self.discard(entry.tag)
+
+        self.clear_stack(self.redo_stack)
+        self.undo_stack.append(entry)
+        self.enforce_budget()
+
+    # removing the top entry if it was recorded with the tag passed
+    def discard(self, tag):
+        if tag is not None and self.undo_stack and self.undo_stack[-1].tag == tag:
+            self.undo_stack.pop().release()
+
+    # returning the channel before the last step and moving the step to the redo stack, None if nothing to undo
+    def undo(self, channel):
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack.pop()
+        entry.tag = None  # a redone step is never replaced by a slider
+        self.redo_stack.append(entry)
+        return entry.undo(channel)
+
+    # returning the channel after the last undone step and moving the step back to the undo stack
+    def redo(self, channel):
+        if not self.redo_stack:
+            return None
+        entry = self.redo_stack.pop()
+        self.undo_stack.append(entry)
+        return entry.redo(channel)
+
+    def can_undo(self):
+        return len(self.undo_stack) > 0
+
+    def can_redo(self):
+        return len(self.redo_stack) > 0
+
+    # returning the (operation, args) of every step from the original to the current image, None if the
+    # steps are not all known (entries dropped or recorded without their step)
+    def steps(self):
+        if self.dropped or any(entry.step is None for entry in self.undo_stack):
+            return None
+        return [entry.step for entry in self.undo_stack]
+
+    # removing all entries, and the spill directory if the history created it (called on exit as well)
+    def clear(self):
+        self.clear_stack(self.undo_stack)
+        self.clear_stack(self.redo_stack)
+        self.dropped = False
+
+        if self.created_spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+            self.created_spill_dir = False
+
+    def clear_stack(self, stack):
+        for entry in stack:
+            entry.release()
+        del stack[:]
+
+    # no. of bytes of memory held by all entries
+    def memory_used(self):
+        return sum(entry.nbytes() for entry in self.undo_stack + self.redo_stack)
+
+    # no. of bytes of spill files written by all entries
+    def disk_used(self):
+        return sum(entry.spilled_bytes for entry in self.undo_stack + self.redo_stack)
+
+    # spilling or dropping the entries farthest from the current image (bottom of each stack) until within budget,
+    # the last step is always kept so that single level undo works whatever the budget
+    def enforce_budget(self):
+        used = self.memory_used()
+
+        for stack, keep in ((self.redo_stack, 0), (self.undo_stack, 1)):
+            i = 0
+            while used > self.memory_budget and i < len(stack) - keep:
+                entry = stack[i]
+                if entry.delta is None:
+                    i += 1  # lookup entries are tiny and spilled entries hold no memory
+                elif self.spill_enabled:
+                    if self.spill_dir is None:
+                        self.spill_dir = tempfile.mkdtemp(prefix='ee610-history-')
+                        self.created_spill_dir = True
+                    used -= entry.nbytes()
+                    entry.spill(self.spill_dir)
+                    i += 1
+                else:
+                    # entries beyond a dropped entry cannot be reached any more so they are dropped as well
+                    dropped, stack[:i + 1] = stack[:i + 1], []
+                    self.clear_stack(dropped)
+                    self.dropped = self.dropped or stack is self.undo_stack
+                    used = self.memory_used()
+                    i = 0
+
+        # dropping spilled entries farthest from the current image (with the entries beyond them, which cannot be
+        # reached any more) until the spill files are within their budget
+        used = self.disk_used()
+        for stack in (self.redo_stack, self.undo_stack):
+            i = 0
+            while used > self.spill_budget and i < len(stack):
+                if stack[i].path is None:
+                    i += 1
+                    continue
+                dropped, stack[:i + 1] = stack[:i + 1], []
+                used -= sum(entry.spilled_bytes for entry in dropped)
+                self.clear_stack(dropped)
+                self.dropped = self.dropped or stack is self.undo_stack
+                i = 0
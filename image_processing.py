@@ -1,8 +1,47 @@
+import threading  # used for keeping scratch buffers separate for each thread
+
 import numpy as np  # used for handling array operations
 
+from tiling import make_scheduler  # used for running neighbourhood filters on image strips in parallel
 
 class ImageProcessing(object):
 
+    lut_cache = {}  # storing lookup tables of point operations keyed by operation name and parameters
+
+    scratch_pool = threading.local()  # storing reusable padded image buffers of each thread
+
+    # cost of a FFT correlation in full frame passes, and smallest image for which the FFT is considered
+    FFT_PASSES = 75
+    FFT_MIN_PIXELS = 64 * 64
+
+    block_rows = 16  # no. of rows interpolated at a time by adaptive histogram equalization, keeps temporaries in cache
+
+    # workers is the no. of threads (or processes) used by blur, sharp and edge detection, defaults to no. of cpu
+    # cores, backend is 'inline', 'thread' or 'process' (see tiling.make_scheduler)
+    def __init__(self, workers=None, backend='thread'):
+        self.tile_scheduler = make_scheduler(backend, workers)
+
+    # changing the no. of threads used by blur, sharp and edge detection
+    def set_workers(self, workers):
+        self.tile_scheduler.set_workers(workers)
+
+    # changing the backend running the strips of blur, sharp and edge detection, the workers of the previous
+    # backend are stopped
+    def set_backend(self, backend, workers=None):
+        self.tile_scheduler.shutdown()
+        self.tile_scheduler = make_scheduler(backend, workers)
+
+    # no. of neighbouring rows needed on each side of a strip for computing the operation passed on it,
+    # point operations need none
+    def halo(self, operation, *args):
+
+        if operation == 'blur':
+            return args[0] // 2  # half of the window size
+        if operation in ('sharp', 'edge_detection'):
+            return 1  # 3x3 Laplacian window
+
+        return 0
+
     # defining convolution in image
     def convolution(self, image, window):
 
@@ -12,64 +51,361 @@ class ImageProcessing(object):
 
         return output  # return the computed image
 
-    # computing histogram equalization of the image
-    def histogram_equalization(self, image):
+    # every operation takes a single image (H, W) or a stack of same sized images (N, H, W) (any no. of leading
+    # axes) processed in one call, channel_axis can be passed for images with channels along another axis
+    # e.g. channel_axis=-1 for (H, W, C), each channel is then processed as a separate image of the stack
+
+    # moving the channel axis of the image to the front so that the image is a stack of 2-D channels
+    def to_stack(self, image, channel_axis):
+
+        if channel_axis is None:
+            return image
+        return np.moveaxis(image, channel_axis, 0)
+
+    # moving the channels of the output stack back to the channel axis of the input image
+    def from_stack(self, output, channel_axis):
+
+        if channel_axis is None:
+            return output
+        return np.ascontiguousarray(np.moveaxis(output, 0, channel_axis))
+
+    # computing histogram equalization of the image, each image of a stack is equalized with its own histogram
+    def histogram_equalization(self, image, channel_axis=None):
+
+        image = self.to_stack(image, channel_axis)
+
+        lut = self.point_lut('histogram_equalization', image)  # deriving lookup from the histogram of the image
+
+        return self.from_stack(self.apply_lut(image, lut), channel_axis)  # return the computed image
+
+    # counting no. of pixels of each value in each image of the stack, returns (..., 256) counts
+    # all images are counted in a single bincount by offsetting the values of image i by 256 * i
+    def histograms(self, image):
 
-        image_row = image.shape[0]  # no. of rows of pixels in the image
-        image_column = image.shape[1]  # no. of columns of pixels in the image
+        if image.ndim == 2:
+            return np.bincount(image.ravel(), minlength=256)
 
-        # counting no. of values in the V channel of a HSV image matrix and setting minlength=256 to
-        # ensure all 256 pixel values are covered and unavailable values are set to 0
-        pmf = np.bincount(image.ravel(), minlength=256)
+        count = int(np.prod(image.shape[:-2]))  # no. of images in the stack
+        values = self.stack_values(image)  # pixel value v of image i counted in bin 256 * i + v
 
-        pmf = pmf / (image_row * image_column)  # computing probability mass function(pmf)
+        return np.bincount(values.ravel(), minlength=256 * count).reshape(image.shape[:-2] + (256,))
 
-        cdf = pmf.cumsum()  # computing cumulative distribution function(cdf) as cumulative sum of pmf
+    # offsetting the pixel values of image i of the stack by 256 * i, in the smallest integer type holding them
+    def stack_values(self, image):
+
+        count = int(np.prod(image.shape[:-2]))  # no. of images in the stack
+        dtype = np.uint16 if count <= 256 else np.intp
+        offsets = (np.arange(count, dtype=dtype) * 256).reshape(image.shape[:-2] + (1, 1))
+
+        return np.add(image, offsets, dtype=dtype)
+
+    # computing the histogram equalization lookup for the histogram (pixel counts) passed
+    def equalization_lut(self, histogram):
+
+        pmf = histogram / histogram.sum(axis=-1, keepdims=True)  # computing probability mass function(pmf)
+
+        cdf = pmf.cumsum(axis=-1)  # computing cumulative distribution function(cdf) as cumulative sum of pmf
 
         # derive lookup for pixel values by multiplying cdf with 255 (max pixel value)
         # round the lookup to lower integer to avoid the pixel value 256
-        pmf_lookup = np.uint8(np.floor(cdf * 255))
+        return np.uint8(np.floor(cdf * 255))
 
-        output = image.copy()  # creating a copy of input image
+    # computing contrast limited adaptive histogram equalization (CLAHE) of the image
+    # the image is split into tiles[0] x tiles[1] tiles, each tile gets the equalization lookup of its own histogram
+    # with counts above clip_limit times the average count clipped and spread evenly over all values (limiting
+    # noise amplification in flat areas), and each pixel is mapped with the lookups of the 4 nearest tile centers
+    # weighted by its distance to them so that no tile borders are visible
+    def adaptive_histogram_equalization(self, image, clip_limit=2.0, tiles=(8, 8), channel_axis=None):
 
-        # for each pixel value replace the value with the corresponding value in lookup generated
-        for r in range(256):
-            output[image == r] = pmf_lookup[r]
+        image = self.to_stack(image, channel_axis)
 
-        return output  # return the computed image
+        image_row = image.shape[-2]  # no. of rows of pixels in the image
+        tile_row, tile_column, row_tiles, column_tiles = self.tile_layout(image_row, image.shape[-1], tiles)
+
+        luts = self.tile_luts(image, row_tiles, column_tiles, tile_row, tile_column, clip_limit)
+
+        # nearest tile centers above/below each row and left/right of each column with the weight of the second one
+        rows = self.interpolation_weights(row_tiles, tile_row)
+        columns = self.interpolation_weights(column_tiles, tile_column)
+
+        # rows are interpolated independently of each other from the shared lookups, strips run in parallel
+        output = self.tile_scheduler.run_rows(self.adaptive_equalization_rows, image_row, image, luts, rows, columns,
+                                              tile_column)
+
+        return self.from_stack(output, channel_axis)  # return the computed image
+
+    # computing (no. of rows of tiles, no. of columns of tiles, tile of each row, tile of each column) of the
+    # adaptive equalization of an image of image_row x image_column pixels, tiles differ in size by at most one pixel
+    def tile_layout(self, image_row, image_column, tiles=(8, 8)):
+
+        tile_row = min(tiles[0], image_row)
+        tile_column = min(tiles[1], image_column)
+
+        row_tiles = np.arange(image_row) * tile_row // image_row
+        column_tiles = np.arange(image_column) * tile_column // image_column
+
+        return tile_row, tile_column, row_tiles, column_tiles
+
+    # computing the clipped equalization lookups of all tiles of each image, returns (..., tile_row * tile_column, 256)
+    def tile_luts(self, image, row_tiles, column_tiles, tile_row, tile_column, clip_limit):
+        histograms = self.tile_histograms(image, row_tiles, column_tiles, tile_row, tile_column)
+        return self.clipped_luts(histograms, clip_limit)
+
+    # counting the histograms of all tiles of each image, returns (..., tile_row * tile_column, 256)
+    # histograms of all tiles (of all images of a stack) are counted in a single bincount with the values of tile t
+    # offset by 256 * t, row_tiles can be the rows of a strip only, the histograms of the strips add up to those of
+    # the image
+    def tile_histograms(self, image, row_tiles, column_tiles, tile_row, tile_column):
+
+        count = int(np.prod(image.shape[:-2]))  # no. of images in the stack
+        tile_count = tile_row * tile_column
+
+        dtype = np.int32 if count * tile_count * 256 <= np.iinfo(np.int32).max else np.intp
+
+        # offsets of the tile of each row and column, and of each image of the stack
+        row_offsets = (row_tiles * tile_column * 256).astype(dtype).reshape(-1, 1)
+        column_offsets = (column_tiles * 256).astype(dtype)
+        image_offsets = (np.arange(count, dtype=dtype) * tile_count * 256).reshape(image.shape[:-2] + (1, 1))
+
+        values = np.add(image, row_offsets + image_offsets, dtype=dtype)
+        values += column_offsets
+        histograms = np.bincount(values.ravel(), minlength=count * tile_count * 256)
+
+        return histograms.reshape(image.shape[:-2] + (tile_count, 256))  # return the histograms of the tiles
+
+    # computing the equalization lookups of the tile histograms with counts above clip_limit times the average count
+    # clipped
+    def clipped_luts(self, histograms, clip_limit):
+
+        histograms = histograms.astype(np.float64)
+
+        # clipping each bin to clip_limit times the average bin count of its tile and spreading the clipped
+        # counts evenly over all 256 bins
+        limit = np.maximum(clip_limit * histograms.sum(axis=-1, keepdims=True) / 256, 1)
+        excess = np.maximum(histograms - limit, 0).sum(axis=-1, keepdims=True)
+        histograms = np.minimum(histograms, limit) + excess / 256
+
+        return self.equalization_lut(histograms).astype(np.float32)  # return the lookups of the tiles
+
+    # computing for each row (or column) the first of the two tile centers it lies between and the weight of
+    # the second one, pixels beyond the first/last center use only the first/last tile
+    def interpolation_weights(self, pixel_tiles, tile_count):
+
+        # center of each tile as mean position of its pixels
+        size = np.bincount(pixel_tiles, minlength=tile_count)
+        centers = np.bincount(pixel_tiles, weights=np.arange(pixel_tiles.size), minlength=tile_count) / size
+
+        position = np.arange(pixel_tiles.size)
+        first = np.clip(np.searchsorted(centers, position, side='right') - 1, 0, tile_count - 1)
+        second = np.minimum(first + 1, tile_count - 1)
+
+        gap = np.where(second > first, centers[second] - centers[first], 1)
+        weight = np.clip((position - centers[first]) / gap, 0, 1).astype(np.float32)
+
+        return first, second, weight
+
+    # computing rows start to stop of the adaptive equalized image by bilinear interpolation between the lookups
+    # of the 4 nearest tiles
+    def adaptive_equalization_rows(self, start, stop, image, luts, rows, columns, tile_column):
+
+        strip = image[..., start:stop, :]
+
+        # lookups of all tiles of all images flattened, value v of tile t of image i is at 256 * (i * tiles + t) + v
+        flat = luts.reshape(-1)
+        count = int(np.prod(image.shape[:-2]))
+        image_offsets = (np.arange(count, dtype=np.int32) * luts.shape[-2] * 256).reshape(image.shape[:-2] + (1, 1))
+        values = np.add(strip, image_offsets, dtype=np.int32)
+
+        # offsets of the lookups of the tiles above/below each row and left/right of each column
+        top, bottom, row_weight = (part[start:stop].reshape(-1, 1) for part in rows)
+        top = (top * tile_column * 256).astype(np.int32)
+        bottom = (bottom * tile_column * 256).astype(np.int32)
+        left, right, column_weight = columns
+        left = (left * 256).astype(np.int32)
+        right = (right * 256).astype(np.int32)
+
+        output = np.empty(values.shape, dtype=np.uint8)
+
+        # interpolating between left and right tiles, then between upper and lower results
+        # a few rows at a time so that the temporary arrays stay in cache
+        for low in range(0, stop - start, self.block_rows):
+            high = min(low + self.block_rows, stop - start)
+            block = values[..., low:high, :]
+            row_top, row_bottom = top[low:high], bottom[low:high]
+
+            upper = np.take(flat, block + (row_top + left))
+            upper += (np.take(flat, block + (row_top + right)) - upper) * column_weight
+            lower = np.take(flat, block + (row_bottom + left))
+            lower += (np.take(flat, block + (row_bottom + right)) - lower) * column_weight
+
+            upper += (lower - upper) * row_weight[low:high]
+            np.rint(upper, out=upper)
+            output[..., low:high, :] = upper
+
+        return output  # return the computed rows
 
     # computing gamma correction of the image passed as ndarray based on gamma value passed
-    def gamma_correction(self, image, gamma):
+    # channel_axis is accepted only so that all operations take the same arguments, the lookup does not depend on
+    # the image so stacks and channels are mapped in any layout without reshaping
+    def gamma_correction(self, image, gamma, channel_axis=None):
+
+        lut = self.point_lut('gamma_correction', image, gamma)
+
+        return self.apply_lut(image, lut)  # return the computed image
+
+    # computing gamma correction on the pixel values passed, used for building the lookup
+    def gamma_lut(self, r, gamma):
 
         normalization_const = 255.0 / np.float_power(255, gamma)  # calculating normalizing constant for image matrix
-        output = np.uint8(normalization_const * np.float_power(image, gamma)) # s = C * r^gamma
 
-        return output  # return the computed image
+        return np.uint8(normalization_const * np.float_power(r, gamma))  # s = C * r^gamma
 
     # computing log transform of the image passed
-    def log_transform(self, image):
+    # channel_axis is accepted only so that all operations take the same arguments, as for gamma_correction
+    def log_transform(self, image, channel_axis=None):
+
+        lut = self.point_lut('log_transform', image)
 
-        image_row = len(image)  # no. of rows in the image matrix
-        image_column = len(image[0])  # no. of columns in the image matrix
+        return self.apply_lut(image, lut)  # return the computed image
+
+    # computing log transform on the pixel values passed, used for building the lookup
+    def log_lut(self, r):
 
         normalization_const = 255 / (np.log2(256))  # calculating normalizing constant for image matrix
 
         # s = C * log(r + 1)
         # 1 is added to input to avoid log(0)
-        output = np.int8(normalization_const * np.log2(image + np.ones((image_row, image_column))))
+        return np.uint8(normalization_const * np.log2(r + 1))
 
-        return output  # return the computed image
+    # returning the 256 entry lookup table of the point operation (name of the method) with args for the image passed
+    def point_lut(self, operation, image, *args):
+
+        if operation == 'histogram_equalization':
+            # counting no. of values in the V channel of a HSV image matrix and setting minlength=256 to
+            # ensure all 256 pixel values are covered and unavailable values are set to 0
+            # a stack of images gives one lookup per image
+            return self.equalization_lut(self.histograms(image))
+
+        if operation == 'gamma_correction':
+            # lookup is built once per gamma value and reused from the cache afterwards
+            gamma = args[0]
+            return self.build_lut(('gamma', gamma), lambda r: self.gamma_lut(r, gamma))
+
+        if operation == 'log_transform':
+            return self.build_lut(('log',), self.log_lut)  # lookup does not depend on any parameter
+
+        raise ValueError("'%s' is not a point operation" % operation)
+
+    # building the 256 entry lookup table of a point operation, or returning it from the cache
+    # key identifies the operation with its parameters and builder maps pixel values 0-255 to output values
+    def build_lut(self, key, builder):
+
+        lut = self.lut_cache.get(key)  # lookup computed earlier for same operation and parameters
+
+        if lut is None:
+            lut = np.ascontiguousarray(builder(np.arange(256)), dtype=np.uint8)
+            self.lut_cache[key] = lut
+
+        return lut  # return the lookup table
+
+    # applying a 256 entry lookup table on the image as a single gather, output[i, j] = lut[image[i, j]]
+    # lut can also hold one lookup per image of the stack (shape (..., 256)), the stacked lookups are then
+    # gathered in one call with the values of image i offset by 256 * i
+    def apply_lut(self, image, lut, out=None):
+
+        if lut.ndim == 1:
+            return np.take(lut, image, out=out)  # return the computed image
+
+        return np.take(lut.reshape(-1), self.stack_values(image), out=out)  # return the computed image
 
     # computing blurred image for the image and window size passed
-    def blur(self, image, window_size):
-        
-        window = np.ones((window_size, window_size), dtype=np.uint8)  # matrix size = window size passed
-        output = self.convolution(image, window)  # performing convolution of image and window
-        
+    # integral image of the image can be passed as sat when it is shared among several window sizes
+    def blur(self, image, window_size, sat=None, channel_axis=None):
+
+        image = self.to_stack(image, channel_axis)
+
+        # strips of the integral image cover the whole window so strips are computed directly from it
+        if sat is not None:
+            output = self.tile_scheduler.run_rows(self.blur_rows, image.shape[-2], image, window_size, sat)
+        else:
+            # strips of the image need window_size // 2 neighbouring rows on each side
+            output = self.tile_scheduler.run(self.blur_frame, image, self.halo('blur', window_size), window_size)
+
+        return self.from_stack(output, channel_axis)  # return the computed image
+
+    # computing rows start to stop of the blurred image from the integral image of the whole image
+    def blur_rows(self, start, stop, image, window_size, sat):
+
+        output = self.box_sum(image, window_size, sat, start, stop)
+
+        return np.uint8(output // (window_size * window_size))  # return the computed rows
+
+    # computing blurred image of the whole frame (or strip) passed in the calling thread
+    def blur_frame(self, image, window_size):
+
+        # box sum over the window from the integral image, cost per pixel does not depend on window size
+        output = self.box_sum(image, window_size)
+
+        # dividing the sum by no. of window elements for normalizing, same as convolution with all ones window
+        output = np.uint8(output // (window_size * window_size))
+
         return output  # return the computed image
 
+    # computing integral image (summed-area table) of the image passed
+    # sat[i, j] holds sum of all pixels above and left of (i, j), first row and column are kept zero
+    def integral_image(self, image):
+
+        image_row = image.shape[-2]  # no. of rows of pixels in the image
+        image_column = image.shape[-1]  # no. of columns of pixels in the image
+
+        # int32 holds the sum of all 8 bit pixels upto ~8 megapixels, larger images need int64
+        dtype = np.int32 if 255 * image_row * image_column < np.iinfo(np.int32).max else np.int64
+
+        sat = np.zeros(image.shape[:-2] + (image_row + 1, image_column + 1), dtype=dtype)
+        np.cumsum(image, axis=-2, dtype=dtype, out=sat[..., 1:, 1:])  # cumulative sum along the columns
+        np.cumsum(sat[..., 1:, 1:], axis=-1, out=sat[..., 1:, 1:])  # cumulative sum along the rows
+
+        return sat  # return the integral image
+
+    # computing sum of pixels in the window_size x window_size window centered at each pixel,
+    # pixels outside the image are taken as zero i.e. same as correlation with zero padding
+    # only rows start to stop of the output are computed when they are passed
+    def box_sum(self, image, window_size, sat=None, start=0, stop=None):
+
+        image_row = image.shape[-2]  # no. of rows of pixels in the image
+        image_column = image.shape[-1]  # no. of columns of pixels in the image
+
+        offset = window_size // 2  # no. of pixels on each side of the center pixel
+
+        # integral image can be passed in when it is shared among several window sizes
+        if sat is None:
+            sat = self.integral_image(image)
+
+        # first and one past last row/column of the window for every pixel, clipped to image borders
+        rows = np.arange(start, image_row if stop is None else stop)
+        row_low = np.clip(rows - offset, 0, image_row)
+        row_high = np.clip(rows + offset + 1, 0, image_row)
+        column_low = np.clip(np.arange(image_column) - offset, 0, image_column)
+        column_high = np.clip(np.arange(image_column) + offset + 1, 0, image_column)
+
+        # window sum = sat[bottom, right] - sat[top, right] - sat[bottom, left] + sat[top, left]
+        vertical = sat.take(row_high, axis=-2) - sat.take(row_low, axis=-2)
+        output = vertical.take(column_high, axis=-1) - vertical.take(column_low, axis=-1)
+
+        return output  # return the window sums
+
     # computing sharpened image for the image and sharpening cost passed
-    def sharp(self, image, sharp_const):
+    def sharp(self, image, sharp_const, channel_axis=None):
+
+        image = self.to_stack(image, channel_axis)
+
+        # strips of the image need 1 neighbouring row on each side for the 3x3 window
+        output = self.tile_scheduler.run(self.sharp_frame, image, self.halo('sharp'), sharp_const)
+
+        return self.from_stack(output, channel_axis)  # return the computed image
+
+    # computing sharpened image of the whole frame (or strip) passed in the calling thread
+    def sharp_frame(self, image, sharp_const):
 
         window = np.array([[1, 1, 1], [1, -8, 1], [1, 1, 1]])  # defining standard 3x3 Laplacian window
 
@@ -82,35 +418,210 @@ class ImageProcessing(object):
         return output  # return the computed image
 
     # computing edges of the image passed using laplacian filter
-    def edge_detection(self, image):
+    def edge_detection(self, image, channel_axis=None):
+
+        image = self.to_stack(image, channel_axis)
+
+        # strips of the image need 1 neighbouring row on each side for the 3x3 window
+        output = self.tile_scheduler.run(self.edge_detection_frame, image, self.halo('edge_detection'))
+
+        return self.from_stack(output, channel_axis)  # return the computed image
+
+    # computing edges of the whole frame (or strip) passed in the calling thread
+    def edge_detection_frame(self, image):
 
         window = np.array([[1, 1, 1], [1, -8, 1], [1, 1, 1]])  # defining window as standard 3x3 Laplacian
         output = self.correlation(image, window)  # performing correlation of image and window
 
-        # keeping output pixels in range 0 to 255
-        output[output < 0] = 0  # replace pixels with value < 0 in output with 0
-        output[output > 255] = 255  # replace pixels with value > 255 in output with 255
+        np.clip(output, 0, 255, out=output)  # keeping output pixels in range 0 to 255
 
         return output  # return the computed image
 
     # computing correlation operation on image and window passed
-    def correlation(self, image, window):
+    # method is one of 'direct', 'separable' or 'fft', 'auto' picks the cheapest one for the image and window
+    # out can be passed to receive the result in an existing array
+    def correlation(self, image, window, method='auto', out=None):
 
-        output = np.zeros_like(image)  # returns zero ndarray of same shape as of the image
-        image_row = image.shape[0]  # no. of rows of pixels in the image
-        image_column = image.shape[1]  # no. of columns of pixels in the image
+        window = np.asarray(window)
 
-        window_size = window.shape[0]  # computing window size from window passed
-        zero_padding = window_size - 1  # computing zero padding requirements
-        offset = int(zero_padding / 2)  # computing offset to be used during convolution
+        if method == 'auto':
+            method = self.correlation_method(image.shape, window)
 
-        # creating the zero padded image
-        image_zero_padded = np.zeros((image_row + zero_padding, image_column + zero_padding))
-        image_zero_padded[offset:(-1 * offset), offset:(-1 * offset)] = image
+        if method == 'direct':
+            return self.direct_correlation(image, window, out=out)
 
-        # computing correlation as shifted sum of image elements keeping window stationary
-        for r in range(window_size):
-            for c in range(window_size):
-                output = output + window[r][c] * image_zero_padded[r:r + image_row, c:c + image_column]
+        if method == 'separable':
+            output = self.separable_correlation(image, window)
+        elif method == 'fft':
+            output = self.fft_correlation(image, window)
+        else:
+            raise ValueError("unknown correlation method '%s'" % method)
+
+        if out is not None:
+            out[...] = output
+            output = out
 
         return output  # return the computed image
+
+    # choosing the correlation method with least estimated cost for the image shape and window passed
+    # costs are counted in full frame passes, FFT_PASSES and FFT_MIN_PIXELS were measured with numpy.fft on
+    # 1 to 24 megapixel frames against the shift and add loop
+    def correlation_method(self, image_shape, window):
+
+        costs = {'direct': np.count_nonzero(window)}  # one pass for every non zero tap
+
+        if self.window_rank(window) == 1:
+            costs['separable'] = window.shape[0] + window.shape[1]  # one pass per tap of each 1-D window
+
+        if image_shape[-2] * image_shape[-1] >= self.FFT_MIN_PIXELS:
+            costs['fft'] = self.FFT_PASSES
+
+        return min(costs, key=costs.get)  # return the cheapest method
+
+    # computing rank of the window, rank 1 windows can be split into a column and a row window
+    def window_rank(self, window):
+
+        if window.ndim != 2 or min(window.shape) == 1:
+            return 1
+        return np.linalg.matrix_rank(window.astype(np.float64))
+
+    # computing correlation as shifted sum of image elements keeping window stationary
+    # the sum is accumulated in place in one int32 (integer image and window) or float32 buffer, zero taps
+    # are skipped and the padded image buffer is reused from the scratch pool across calls
+    # taps of weight +-1 are added/subtracted directly, a tap of any other weight needs a product buffer unless it
+    # is the first tap (which initializes the output), so such a tap is taken first (e.g. the centre of the
+    # laplacian) and the product buffer is only allocated, for this call only, when there are several of them
+    def direct_correlation(self, image, window, out=None):
+
+        image_row = image.shape[-2]  # no. of rows of pixels in the image
+        image_column = image.shape[-1]  # no. of columns of pixels in the image
+
+        window_row, window_column = window.shape  # computing window size from window passed
+        row_offset = (window_row - 1) // 2  # computing offsets to be used during correlation
+        column_offset = (window_column - 1) // 2
+
+        dtype = self.accumulator_dtype(image, window)  # data type of the accumulator
+
+        if out is None:
+            out = np.empty(image.shape, dtype=dtype)
+
+        # creating the zero padded image in a reused buffer, only the border needs to be zeroed
+        # as the inside is overwritten by the image
+        # leading axes of a stack of images are kept, only rows and columns are padded
+        image_zero_padded = self.scratch('padded', image.shape[:-2] + (image_row + window_row - 1,
+                                                                      image_column + window_column - 1), image.dtype)
+        image_zero_padded[..., :row_offset, :] = 0
+        image_zero_padded[..., row_offset + image_row:, :] = 0
+        image_zero_padded[..., :column_offset] = 0
+        image_zero_padded[..., column_offset + image_column:] = 0
+        image_zero_padded[..., row_offset:row_offset + image_row, column_offset:column_offset + image_column] = image
+
+        taps = [(r, c, window[r][c]) for r in range(window_row) for c in range(window_column) if window[r][c] != 0]
+        taps.sort(key=lambda tap: tap[2] in (1, -1))  # stable, taps of other weights first
+
+        if not taps:
+            out[...] = 0  # all zero window gives all zero output
+            return out
+
+        product = None  # buffer of the product of a tap, not kept after the call
+
+        # computing correlation as shifted sum of image elements keeping window stationary
+        for i, (r, c, weight) in enumerate(taps):
+            shifted = image_zero_padded[..., r:r + image_row, c:c + image_column]
+
+            if i == 0:
+                np.multiply(shifted, weight, out=out, dtype=dtype, casting='unsafe')  # first tap initializes output
+            elif weight == 1:
+                np.add(out, shifted, out=out, dtype=dtype, casting='unsafe')
+            elif weight == -1:
+                np.subtract(out, shifted, out=out, dtype=dtype, casting='unsafe')
+            else:
+                if product is None:
+                    product = np.empty(image.shape, dtype=dtype)
+                np.multiply(shifted, weight, out=product, dtype=dtype, casting='unsafe')
+                np.add(out, product, out=out, dtype=dtype, casting='unsafe')
+
+        return out  # return the computed image
+
+    # choosing data type of the correlation accumulator, integers are summed exactly in int32
+    # (int64 if the window weights are large enough to overflow it) and anything else in float32
+    def accumulator_dtype(self, image, window):
+
+        if np.issubdtype(image.dtype, np.integer) and np.issubdtype(window.dtype, np.integer):
+            bound = int(np.abs(window).sum()) * int(np.iinfo(image.dtype).max)
+            return np.int32 if bound <= np.iinfo(np.int32).max else np.int64
+
+        return np.float32
+
+    # returning a reusable buffer of the given shape and data type from the scratch pool of the calling thread,
+    # one buffer is kept per name and it is reallocated only when shape or data type changes
+    def scratch(self, name, shape, dtype):
+
+        if not hasattr(self.scratch_pool, 'buffers'):
+            self.scratch_pool.buffers = {}
+
+        buffer = self.scratch_pool.buffers.get(name)
+
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self.scratch_pool.buffers[name] = buffer
+
+        return buffer
+
+    # computing correlation with a rank 1 window as a column correlation followed by a row correlation
+    def separable_correlation(self, image, window):
+
+        # splitting the window into outer product of a column and a row using its largest singular value
+        u, singular, vt = np.linalg.svd(window.astype(np.float64))
+        column_window = (u[:, 0] * singular[0]).reshape(-1, 1)
+        row_window = vt[0].reshape(1, -1)
+
+        output = self.direct_correlation(image, column_window)  # correlating along the columns
+        output = self.direct_correlation(output, row_window)  # correlating the result along the rows
+
+        return self.round_integer_result(output, image, window)  # return the computed image
+
+    # computing correlation as product of image and window spectra using numpy.fft
+    # transforms are taken over the last two axes so a stack of images shares the window spectrum
+    def fft_correlation(self, image, window):
+
+        image_row = image.shape[-2]  # no. of rows of pixels in the image
+        image_column = image.shape[-1]  # no. of columns of pixels in the image
+
+        window_row, window_column = window.shape  # computing window size from window passed
+        row_offset = (window_row - 1) // 2  # computing offsets of the window center
+        column_offset = (window_column - 1) // 2
+
+        # linear (not circular) convolution needs the transform to cover image and window together,
+        # sizes are rounded up to products of 2, 3 and 5 for which the FFT is fast
+        shape = (self.fft_size(image_row + window_row - 1), self.fft_size(image_column + window_column - 1))
+
+        # correlation is convolution with the window flipped in both directions
+        spectrum = np.fft.rfft2(image, shape) * np.fft.rfft2(window[::-1, ::-1], shape)
+        output = np.fft.irfft2(spectrum, shape)
+
+        # cropping the part aligned with the window center for each pixel
+        output = output[..., row_offset:row_offset + image_row, column_offset:column_offset + image_column]
+
+        return self.round_integer_result(output, image, window)  # return the computed image
+
+    # finding smallest size >= n which has only 2, 3 and 5 as prime factors
+    def fft_size(self, n):
+
+        size = n
+        while True:
+            remaining = size
+            for factor in (2, 3, 5):
+                while remaining % factor == 0:
+                    remaining //= factor
+            if remaining == 1:
+                return size
+            size += 1
+
+    # rounding off floating point error of FFT and SVD based results when image and window are
+    # integers so that the output is identical to the direct method
+    def round_integer_result(self, output, image, window):
+
+        if np.issubdtype(image.dtype, np.integer) and np.issubdtype(window.dtype, np.integer):
+            output = np.rint(output)
+        return output
@@ -3,20 +3,31 @@
 # reference: in the report
 
 # importing utility libraries
+import time  # used for measuring startup time
+startup_clock = time.perf_counter()  # time main started loading, before any other import
+
+import argparse  # used for parsing profiling arguments
 import sys  # used for parsing GUI arguments
 import cv2  # used for reading/writing images and colorspace conversion
 
-import matplotlib.pyplot as plt  # used for pop-up plots
-
 # PyQt5 libraries are used for GUI
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 
-from PyQt5.QtWidgets import QApplication, QFileDialog, QDialog, QWidget, QMainWindow
+from PyQt5.QtWidgets import QApplication, QFileDialog, QDialog, QWidget, QMainWindow, QProgressBar, QLabel
 
 # importing ui and image processing modules
 from image_processing import *
 from ui import *
+from worker import JobRunner
+from history import UndoHistory
+from cache import ResultCache
+from pyramid import ImagePyramid
+from profiler import Profiler
+from histogram import HistogramTracker
+from tiling import BACKENDS
+from session import Session, DiskCache, open_project, PROJECT_EXTENSION
+from writer import ImageWriter
 
 
 # main GUI window class
@@ -26,12 +37,20 @@ class ImageEditorClass(QMainWindow):
 
     current_img = [0]  # storing the current image for processing
 
-    prev_img = [0]  # storing the previous image for use in Undo functionality
-
     img_blur = [0]  # storing copy of image being blurred
 
     img_sharp = [0]  # storing copy of image being sharpened
 
+    proxy_img = [0]  # storing low resolution copy of the visible part of the image being blurred/sharpened, used
+    # while dragging sliders
+    proxy_source = None  # storing the image proxy_img was computed from
+    proxy_scale = 1.0  # storing ratio of proxy image size to original image size
+    proxy_region = None  # storing region (x0, y0, x1, y1) of the image covered by proxy_img
+
+    preview_code = -1  # storing code of operation shown only on the proxy image, -1 if none
+
+    slider_session = 0  # storing no. of the current blur/sharpen slider session, used to tag its history entry
+
     # storing current image height and width
     img_width = 0
     img_height = 0
@@ -40,6 +59,20 @@ class ImageEditorClass(QMainWindow):
 
     current_code = -1  # storing code of current operation
 
+    # encoder options of saved images, keyword arguments of writer.write_image (None keeps the encoder default)
+    save_options = {'quality': None, 'compression': None, 'progressive': False}
+
+    # file types of the save dialog box => extension added to names typed without one
+    save_filters = (('JPEG image (*.jpg *.jpeg)', 'jpg'), ('PNG image (*.png)', 'png'), ('WebP image (*.webp)', 'webp'),
+                    ('TIFF image (*.tif *.tiff)', 'tiff'), ('Project file (*.json)', 'json'))
+
+    exported = pyqtSignal(str, object)  # emitted from the writer thread with the path and error of a saved image
+
+    # handlers called on button and slider events, each call starts a new operation in the profiler overlay
+    handlers = ('open_image', 'save_image', 'histogram_equalization', 'gamma_correction', 'log_transform', 'blur',
+                'sharpen', 'undo', 'redo', 'undo_all', 'view_histogram', 'edge_detection',
+                'adaptive_histogram_equalization')
+
     # codes of different operations
     # Histogram Equalization => 0
     # Gamma Correction => 1
@@ -48,9 +81,10 @@ class ImageEditorClass(QMainWindow):
     # Blur => 4
     # Sharpen => 5
     # Edge detection => 6
+    # Adaptive histogram equalization => 7
 
-    # GUI initialization
-    def __init__(self, parent=None):
+    # GUI initialization, profiler is passed when the application is profiled
+    def __init__(self, parent=None, profiler=None):
         # initializing QWidget Qt module
         super(ImageEditorClass, self).__init__()
         QWidget.__init__(self, parent)
@@ -62,21 +96,80 @@ class ImageEditorClass(QMainWindow):
         self.ui.saveImageButton.clicked.connect(lambda: self.save_image())
 
         self.ui.histogramEqualizationButton.clicked.connect(lambda: self.histogram_equalization())
+        self.ui.adaptiveEqualizationButton.clicked.connect(lambda: self.adaptive_histogram_equalization())
         self.ui.logTransformButton.clicked.connect(lambda: self.log_transform())
         self.ui.gammaCorrectionButton.clicked.connect(lambda: self.gamma_correction())
 
         self.ui.blurExtendInputSlider.valueChanged.connect(lambda: self.blur())
         self.ui.sharpenExtendInputSlider.valueChanged.connect(lambda: self.sharpen())
 
+        # while a slider is dragged only the proxy image is processed, full resolution image is computed on release
+        self.ui.blurExtendInputSlider.sliderReleased.connect(lambda: self.finish_preview())
+        self.ui.sharpenExtendInputSlider.sliderReleased.connect(lambda: self.finish_preview())
+
         self.ui.undoButton.clicked.connect(lambda: self.undo())
+        self.ui.redoButton.clicked.connect(lambda: self.redo())
         self.ui.undo_allButton.clicked.connect(lambda: self.undo_all())
 
+        self.ui.viewHistogramButton.setCheckable(True)
+        self.ui.viewHistogramButton.setChecked(True)  # histogram panel is shown on start
         self.ui.viewHistogramButton.clicked.connect(lambda: self.view_histogram())
         self.ui.detectEdgeButton.clicked.connect(lambda: self.edge_detection())
 
         # initializes input dialog box gui for input of gamma value
         self.newDialog = InputDialogGuiClass(self)
 
+        # undo/redo history storing changes of the V channel within a memory budget
+        self.history = UndoHistory()
+
+        # path of the original image, saved in project files with the steps of the history
+        self.image_path = None
+        self.disk_cache = None  # intermediate results of project steps, opened on first use of a project
+
+        # blur/sharpen results of each slider position and the shared integral image of the blur source
+        self.result_cache = ResultCache()
+
+        # histogram of the V channel shown in the histogram panel, updated from the lookup of point operations
+        self.histogram_tracker = HistogramTracker()
+
+        # images are saved on a background writer thread in the order they were saved, the current image is
+        # passed without copying and is copied before the next edit if it is still being written
+        self.image_writer = ImageWriter()
+        self.exported.connect(self.show_export)
+
+        # tiled multi-resolution pyramid of the current image, only the tiles visible in the image view are
+        # computed and only tiles whose pixels change are computed again after an edit
+        self.pyramid = ImagePyramid()
+        self.ui.imageView.set_pyramid(self.pyramid)
+
+        # operations run on a background thread and post their result back to the GUI thread
+        self.job_runner = JobRunner(self.img_object.tile_scheduler, self)
+        self.job_runner.failed.connect(lambda error: self.ui.statusbar.showMessage(error.splitlines()[-1]))
+
+        # progress bar in the status bar is shown while an operation is running
+        self.progressBar = QProgressBar(self)
+        self.progressBar.setMaximumWidth(200)
+        self.progressBar.hide()
+        self.ui.statusbar.addPermanentWidget(self.progressBar)
+        self.job_runner.progress.connect(self.progressBar.setValue)
+        self.job_runner.busy.connect(self.show_progress)
+
+        # timing breakdown of the last operation is shown in the status bar while profiling
+        self.profiler = profiler
+        if profiler is not None:
+            self.profileLabel = QLabel(self)
+            self.ui.statusbar.addWidget(self.profileLabel, 1)
+            self.profileTimer = QTimer(self)
+            self.profileTimer.timeout.connect(self.show_profile)
+            self.profileTimer.start(500)
+
+    # called when the window is closed, spilled undo steps are removed from the disk
+    def closeEvent(self, event):
+        self.job_runner.cancel()
+        self.job_runner.flush()  # waiting for a running job, its result is dropped
+        self.history.clear()
+        QMainWindow.closeEvent(self, event)
+
     # called when Open button is clicked
     def open_image(self):
         self.set_default_slider()  # resetting blur and sharpen sliders to initial position
@@ -86,12 +179,20 @@ class ImageEditorClass(QMainWindow):
 
         # check if image path is not null or empty
         if image_path:
+            self.job_runner.cancel()  # results of operations on the previous image are not needed
+
             # initialize class variables
             self.current_img = [0]
             self.current_code = -1
 
             # read image at selected path to a numpy ndarray object as color image
+            # a project file gives its original image and the steps applied to it
             path, _ = image_path
+            session = None
+            if path.endswith(PROJECT_EXTENSION):
+                session = open_project(path, self.project_cache(), self.img_object)
+                path = session.image_path
+            self.image_path = path
             self.current_img = cv2.imread(path, 1)
 
             # convert the image read to HSV format from default BGR format
@@ -102,9 +203,16 @@ class ImageEditorClass(QMainWindow):
             self.img_height = self.current_img.shape[0]
 
             self.original_img = self.current_img.copy()
-            self.prev_img = self.current_img.copy()
+            self.history.clear()
+            self.result_cache.clear()
 
-            self.display_image()  # converting current image from ndarry to pixmap and assigns it to image display label
+            if session is not None:
+                self.load_session(session)
+            self.histogram_tracker.count(self.current_img[:, :, 2], exact=True)  # counted once, then kept updated
+
+            self.display_image()  # showing current image in the image view
+            self.ui.imageView.fit_to_window()  # new image is shown whole
+            self.show_histogram()
 
             # enabling all buttons and sliders in the window.
             # Only Open button is enabled on start
@@ -117,31 +225,66 @@ class ImageEditorClass(QMainWindow):
         dialog.setDefaultSuffix('jpg')
         dialog.setAcceptMode(QFileDialog.AcceptSave)
 
+        # format of names typed without extension follows the file type selected
+        suffixes = dict(self.save_filters)
+        dialog.setNameFilters([name for name, _ in self.save_filters])
+        dialog.filterSelected.connect(lambda name: dialog.setDefaultSuffix(suffixes[name]))
+
+        self.finish_pending()  # completing previews and background operations before using the current image
+
         # open the save dialog box and wait until user clicks 'Save' button in the dialog box
         if dialog.exec_() == QDialog.Accepted:
 
             save_image_filename = dialog.selectedFiles()[0]  # select the first path as image save location
 
-            # write current image to the file path selected by user
-            cv2.imwrite(save_image_filename,
-                        cv2.cvtColor(self.current_img, cv2.COLOR_HSV2BGR))
+            # a project file stores the original image path and the steps of the history instead of the pixels
+            if save_image_filename.endswith(PROJECT_EXTENSION):
+                self.save_session(save_image_filename)
+                return
+
+            # queue current image to be converted to BGR and written to the file path selected by user, the editor
+            # stays usable while it is written
+            self.image_writer.submit(self.current_img, save_image_filename,
+                                     lambda path, error: self.exported.emit(path, error),
+                                     conversion=cv2.COLOR_HSV2BGR, **self.save_options)
+            self.ui.statusbar.showMessage('saving %s (%d pending)' % (save_image_filename,
+                                                                     self.image_writer.pending_count()))
+
+    # show_export shows in the status bar that the image at path was saved, or why it was not
+    def show_export(self, path, error):
+        if error is not None:
+            self.ui.statusbar.showMessage('could not save %s: %s' % (path, error))
+        else:
+            self.ui.statusbar.showMessage('saved %s' % path, 5000)
 
     # called when Histogram Equalization button is clicked
     def histogram_equalization(self):
-        self.update_previous_image()  # updating the previous image class variable with current image
+        self.finish_pending()  # completing previews and background operations before using the current image
 
         self.current_code = 0  # updating current operation code class variable
 
         self.set_default_slider()  # resetting blur and sharpen sliders to initial position
 
         # update V channel of the current image with histogram equallized matrix
-        self.current_img[:, :, 2] = self.img_object.histogram_equalization(self.current_img[:, :, 2])
+        self.job_runner.submit(0, self.point_operation, ('histogram_equalization', self.current_img[:, :, 2]),
+                               self.commit_operation)
 
-        self.display_image()  # converting current image from ndarry to pixmap and assigns it to image display label
+    # called when Adaptive Equalization button is clicked
+    def adaptive_histogram_equalization(self):
+        self.finish_pending()  # completing previews and background operations before using the current image
 
-    def gamma_correction(self):
+        self.current_code = 7  # updating current operation code class variable
+
+        self.set_default_slider()  # resetting blur and sharpen sliders to initial position
 
-        self.update_previous_image()  # updating the previous image class variable with current image
+        # update V channel of the current image with contrast limited adaptive equalization of 8 x 8 tiles, the
+        # lookup differs from tile to tile so the change is stored like a neighbourhood operation
+        self.job_runner.submit(7, self.neighbourhood_operation,
+                               (self.img_object.adaptive_histogram_equalization, self.current_img[:, :, 2], None),
+                               self.commit_operation)
+
+    def gamma_correction(self):
+        self.finish_pending()  # completing previews and background operations before using the current image
 
         self.current_code = 1  # update current operation code class variable
 
@@ -159,24 +302,23 @@ class ImageEditorClass(QMainWindow):
             # restricted to 0 to 10 in the gamma input dialog box
             if gamma_value > 0:
                 # update V channel of the current image with gamma corrected matrix
-                self.current_img[:, :, 2] = self.img_object.gamma_correction(self.current_img[:, :, 2], gamma_value)
-
-        self.display_image()  # converting current image from ndarry to pixmap and assigns it to image display label
+                self.job_runner.submit(1, self.point_operation,
+                                       ('gamma_correction', self.current_img[:, :, 2], gamma_value),
+                                       self.commit_operation)
 
     def log_transform(self):
-        self.update_previous_image()  # updating the previous image class variable with current image
+        self.finish_pending()  # completing previews and background operations before using the current image
 
         self.current_code = 2  # update current operation code class variable
 
         self.set_default_slider()  # resetting blur and sharpen sliders to initial position
 
         # update V channel of the current image with log transformed matrix
-        self.current_img[:, :, 2] = self.img_object.log_transform(self.current_img[:, :, 2])
-
-        self.display_image()  # converting current image from ndarry to pixmap and assigns it to image display label
+        self.job_runner.submit(2, self.point_operation, ('log_transform', self.current_img[:, :, 2]),
+                               self.commit_operation)
 
-    def blur(self):
-        self.update_previous_image()  # updating the previous image class variable with current image
+    def blur(self, full_resolution=False):
+        self.job_runner.flush_other(4)  # completing background operations other than blur
 
         # disconnect, initialize and reconnect the sharpen slider valuechanged event
         # this is to avoid calling of sharpen function when sharpen slider value is reset
@@ -195,20 +337,43 @@ class ImageEditorClass(QMainWindow):
             self.current_img = self.img_blur.copy()
         else:
             self.img_blur = self.current_img.copy()
+            self.slider_session += 1
 
-        if blur_value > 0:
-            self.ui.undoButton.setEnabled(True)  # enable undo button
+        self.current_code = 4  # update current operation code class variable
+        self.ui.blurValueLabel.setText(str(blur_value))
 
-            # update V channel of the current image with blurred V matrix
-            self.current_img[:, :, 2] = self.img_object.blur(self.current_img[:, :, 2], blur_window_size)
+        # while the slider is being dragged blur only the proxy image with window scaled to the proxy size
+        if not full_resolution and self.ui.blurExtendInputSlider.isSliderDown():
+            self.job_runner.cancel()  # full resolution blur of an earlier slider position is not needed
+            self.preview_code = 4
+            proxy = self.proxy_image(self.img_blur)
+            proxy_value = int(round(blur_value * self.proxy_scale))
 
-        self.current_code = 4  # update current operation code class variable
+            if proxy_value > 0:
+                proxy[:, :, 2] = self.img_object.blur(proxy[:, :, 2], (proxy_value * 2) + 1)
 
-        self.ui.blurValueLabel.setText(str(blur_value))
-        self.display_image()
+            self.display_image(proxy, self.proxy_region)
+            return
+
+        self.preview_code = -1
+
+        if blur_value > 0:
+            # update V channel of the current image with blurred V matrix, slider events arriving within the
+            # debounce delay are coalesced and a newer slider value replaces the blur still being computed
+            # history entries of the same slider session replace each other
+            self.job_runner.submit(4, self.slider_operation,
+                                   (4, self.img_blur[:, :, 2], self.slider_session, blur_window_size),
+                                   self.commit_operation, self.job_runner.debounce, supersede=True)
+        else:
+            self.job_runner.cancel()
+            self.history.discard(self.slider_session)  # image is back to the state before blurring
+            self.pyramid.replace_value(self.current_img)  # only V differs from the blurred image shown
+            self.update_history_buttons()
+            self.display_image()
+            self.update_histogram()
 
-    def sharpen(self):
-        self.update_previous_image()  # updating the previous image class variable with current image
+    def sharpen(self, full_resolution=False):
+        self.job_runner.flush_other(5)  # completing background operations other than sharpen
 
         # disconnect, initialize and reconnect the blur slider value changed event
         # this is to avoid calling of blur function when blur slider value is reset
@@ -227,87 +392,276 @@ class ImageEditorClass(QMainWindow):
             self.current_img = self.img_sharp.copy()
         else:
             self.img_sharp = self.current_img.copy()
+            self.slider_session += 1
+
+        self.current_code = 5  # update current operation code class variable
+        self.ui.sharpenValueLabel.setText(str(sharpen_value))
+
+        # while the slider is being dragged sharpen only the proxy image
+        if not full_resolution and self.ui.sharpenExtendInputSlider.isSliderDown():
+            self.job_runner.cancel()  # full resolution sharpen of an earlier slider position is not needed
+            self.preview_code = 5
+            proxy = self.proxy_image(self.img_sharp)
+
+            if sharpen_const > 0:
+                proxy[:, :, 2] = np.uint8(self.img_object.sharp(proxy[:, :, 2], sharpen_const))
+
+            self.display_image(proxy, self.proxy_region)
+            return
+
+        self.preview_code = -1
 
         if sharpen_const > 0:
-            self.ui.undoButton.setEnabled(True)  # enable undo button
+            # update V channel of the current image with sharpened V channel matrix, slider events arriving within
+            # the debounce delay are coalesced and a newer slider value replaces the sharpen still being computed
+            # history entries of the same slider session replace each other
+            self.job_runner.submit(5, self.slider_operation,
+                                   (5, self.img_sharp[:, :, 2], self.slider_session, sharpen_const),
+                                   self.commit_operation, self.job_runner.debounce, supersede=True)
+        else:
+            self.job_runner.cancel()
+            self.history.discard(self.slider_session)  # image is back to the state before sharpening
+            self.pyramid.replace_value(self.current_img)  # only V differs from the sharpened image shown
+            self.update_history_buttons()
+            self.display_image()
+            self.update_histogram()
 
-            # update V channel of the current image with sharpened V channel matrix
-            self.current_img[:, :, 2] = np.uint8(self.img_object.sharp(self.current_img[:, :, 2], sharpen_const))
+    def undo(self):
+        self.finish_pending()  # completing previews and background operations before using the current image
 
-        self.current_code = 5  # update current operation code class variable
+        # undone image starts a new operation, sliders start again from the undone image
+        self.current_code = -1
+        self.set_default_slider()
 
-        self.ui.sharpenValueLabel.setText(str(sharpen_value))
+        channel = self.history.undo(self.current_img[:, :, 2])
+        if channel is not None:
+            self.set_channel(channel)
+            self.update_histogram(self.history.redo_stack[-1].inverse_lut)  # lookup entries update the histogram exactly
+
+        self.update_history_buttons()
         self.display_image()
 
-    def undo(self):
-        self.ui.undoButton.setEnabled(False)
-        self.current_img = self.prev_img.copy()
+    def redo(self):
+        self.finish_pending()  # completing previews and background operations before using the current image
+
+        self.current_code = -1
+        self.set_default_slider()
+
+        channel = self.history.redo(self.current_img[:, :, 2])
+        if channel is not None:
+            self.set_channel(channel)
+            self.update_histogram(self.history.undo_stack[-1].lut)  # lookup entries update the histogram exactly
+
+        self.update_history_buttons()
         self.display_image()
 
     def undo_all(self):
+        self.job_runner.cancel()  # results of running operations are not needed
+
         # resetting blur and sharpen sliders to initial position
+        self.current_code = -1
         self.set_default_slider()
         self.current_img = self.original_img.copy()
+        self.pyramid.replace_value(self.current_img)  # only V differs from the edited image shown
+        self.history.clear()
 
         # converting current image from ndarry format to pixmap and assigns it to image display label
         self.display_image()
-        self.ui.undoButton.setEnabled(False)
+        self.update_history_buttons()
+        self.update_histogram()
 
+    # view_histogram shows or hides the histogram panel below the image
     def view_histogram(self):
-        # count the no of values corresponding to each value in the V channel of
-        # image matrix give a minimum length of 256 to the counting to ensure all 256 pixel
-        # values are covered or pixel values not available in image are set to zero
-        histogram = np.bincount(self.current_img[:, :, 2].ravel(), minlength=256)
-
-        # start a new figure to show histogram - assign title and axes label
-        plt.figure(num='Image Histogram')
-
-        # assign a discrete plot of histogram to figure
-        plt.stem(histogram)
-        plt.xlabel('Intensity levels')
-        plt.ylabel('No. of pixels')
+        self.finish_pending()  # completing previews and background operations before using the current image
 
-        # show the stem plot
-        plt.show()
+        self.ui.histogramView.setVisible(self.ui.viewHistogramButton.isChecked())
+        self.show_histogram()
 
     def edge_detection(self):
-        self.update_previous_image()  # updating the previous image class variable with current image
+        self.finish_pending()  # completing previews and background operations before using the current image
         self.current_code = 6  # updating current operation code class variable
 
         self.set_default_slider()  # resetting blur and sharpen sliders to initial position
 
         # update V channel of the current image with edge detected V channel matrix
-        self.current_img[:, :, 2] = self.img_object.edge_detection(self.current_img[:, :, 2])
-
-        self.display_image()
-
-    # display_image converts current image from ndarry format to pixmap and assigns it to image display label
-    def display_image(self):
-        display_size = self.ui.imageDisplayLabel.size()  # setting display size to size of the image display label
+        self.job_runner.submit(6, self.neighbourhood_operation,
+                               (self.img_object.edge_detection, self.current_img[:, :, 2], None),
+                               self.commit_operation)
+
+    # point_operation computes the point operation (name of the ImageProcessing method) on the V channel passed
+    # with its history entry storing only the lookup, and the lookup itself, called on the background thread
+    def point_operation(self, operation, channel, *args):
+        lut = self.img_object.point_lut(operation, channel, *args)
+        output = self.img_object.apply_lut(channel, lut)
+
+        return output, self.history.make_entry(channel, output, lut, step=(operation, args)), lut
+
+    # neighbourhood_operation computes function on the V channel passed with its history entry storing the
+    # compressed change of the channel, tag identifies the slider session, called on the background thread
+    def neighbourhood_operation(self, function, channel, tag, *args):
+        output = np.uint8(function(channel, *args))
+
+        return output, self.history.make_entry(channel, output, tag=tag, step=(function.__name__, args)), None
+
+    # slider_operation computes blur (code 4, value is window size) or sharpen (code 5, value is sharpen constant)
+    # on the V channel of the slider session tag, results are cached so that slider positions visited before are
+    # not computed again and all blur window sizes share one integral image, called on the background thread
+    def slider_operation(self, code, channel, tag, value):
+        if code == 4:
+            sat = self.result_cache.get_or_compute((tag, 'integral_image'), self.img_object.integral_image, channel)
+            function = lambda: self.img_object.blur(channel, value, sat)
+            step = ('blur', (value,))
+        else:
+            function = lambda: np.uint8(self.img_object.sharp(channel, value))
+            step = ('sharp', (value,))
 
-        image = np.array(self.current_img.copy())  # copying current image to temporary variable for processing pixmap
-        zero = np.array([0])
+        output = self.result_cache.get_or_compute((tag, code, value), function)
 
-        # display image if image is not [0] array
-        if not np.array_equal(image, zero):
-            image = cv2.cvtColor(image, cv2.COLOR_HSV2RGB)  # convert HSV image to RGB format for display in label
+        return output, self.history.make_entry(channel, output, tag=tag, step=step), None
 
-            # ndarray cannot be directly converted to QPixmap format required by image display label so ndarray is
-            # first converted to QImage and then QImage to QPixmap convert image ndarray to QImage format
-            qImage = QImage(image, self.img_width, self.img_height,
-                            self.img_width * 3, QImage.Format_RGB888)
+    # commit_operation is called on the GUI thread with the V channel, history entry and lookup (None unless it is a
+    # point operation) computed by an operation
+    def commit_operation(self, result):
+        channel, entry, lut = result
 
-            # converting QImage to QPixmap for loading in image display label
-            pixmap = QPixmap()
-            QPixmap.convertFromImage(pixmap, qImage)
-            pixmap = pixmap.scaled(display_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.history.push(entry)
+        self.set_channel(channel)
 
-            self.ui.imageDisplayLabel.setPixmap(pixmap)  # set pixmap to image display label in GUI
+        self.update_history_buttons()
+        self.display_image()
+        self.update_histogram(lut)
+
+    # project_cache returns the disk cache of intermediate results of project steps, opened on first use
+    def project_cache(self):
+        if self.disk_cache is None:
+            self.disk_cache = DiskCache()
+        return self.disk_cache
+
+    # load_session sets the current image to the result of the steps of the session (computing only the steps
+    # not found in the disk cache) and records every step in the history so that they can be undone
+    def load_session(self, session):
+        session.load_image(self.original_img)
+
+        before = self.original_img[:, :, 2]
+        for count, step in enumerate(session.steps, 1):
+            after = session.channel(count)
+            self.history.push(self.history.make_entry(before, after, step=step))
+            before = after
+
+        self.current_img[:, :, 2] = before
+
+    # save_session writes the project file of the original image and the steps of the history
+    def save_session(self, project_path):
+        steps = self.history.steps()
+        if steps is None:
+            self.ui.statusbar.showMessage('project not saved: the oldest steps were dropped from the history')
+            return
+
+        session = Session(self.image_path, steps, self.project_cache(), self.img_object)
+        session.load_image(self.original_img)
+        session.save(project_path)
+
+        # storing the V channel after every step in the disk cache, so that reopening the project reads them and
+        # changing a step computes only the steps after it, earlier channels are found by undoing the history
+        channel = self.current_img[:, :, 2]
+        for key, entry in zip(reversed(session.keys()[1:]), reversed(self.history.undo_stack)):
+            if not self.disk_cache.contains(key):
+                self.disk_cache.put(key, channel)
+            channel = entry.undo(channel)
+
+    # update_histogram updates the histogram after the V channel changed, lut is passed for point operations
+    # whose lookup maps the previous histogram to the new one, otherwise the channel is counted from a sample
+    def update_histogram(self, lut=None):
+        self.histogram_tracker.update(lut)
+        self.show_histogram()
+
+    # show_histogram shows the histogram of the current V channel in the histogram panel if it is visible
+    def show_histogram(self):
+        if self.ui.histogramView.isVisible() and isinstance(self.current_img, np.ndarray):
+            histogram = self.histogram_tracker.get(self.current_img[:, :, 2])
+            self.ui.histogramView.set_histogram(histogram, self.histogram_tracker.exact)
+
+    # update_history_buttons enables Undo and Redo buttons only when there is a step to undo or redo
+    def update_history_buttons(self):
+        self.ui.undoButton.setEnabled(self.history.can_undo())
+        self.ui.redoButton.setEnabled(self.history.can_redo())
+
+    # show_progress shows the progress bar while background operations are running and hides it afterwards
+    def show_progress(self, busy):
+        self.progressBar.setValue(0)
+        self.progressBar.setVisible(busy)
+
+    # set_channel replaces V channel of the current image, pyramid tiles of the pixels which change are dropped
+    # edits change only V, so the V channel the pyramid was showing is compared with the new one in a single pass
+    # (blur/sharpen replace the current image with a copy of their source before committing)
+    def set_channel(self, channel):
+        # an image still being saved is not changed, the edit is made on a copy
+        if self.image_writer.holds(self.current_img):
+            self.current_img = self.current_img.copy()
+
+        self.pyramid.replace_value(self.current_img, channel)
+        self.current_img[:, :, 2] = channel
+
+    # show_startup_time prints time taken from loading main to showing the window
+    def show_startup_time(self):
+        sys.stderr.write('window shown %.1f ms after start\n' % ((time.perf_counter() - startup_clock) * 1e3))
+
+    # show_profile shows the time taken by each stage of the last operation in the status bar
+    def show_profile(self):
+        entry_points = ['%s.%s' % (ImageEditorClass.__name__, handler) for handler in self.handlers]
+        self.profileLabel.setText(self.profiler.summary(self.profiler.last_operation(entry_points)))
+
+    # display_image shows current image in the image view, only tiles visible at the current zoom are converted
+    # image can be passed to display some other HSV image (e.g. a proxy preview) covering region (x0, y0, x1, y1)
+    # of the current image instead
+    def display_image(self, image=None, region=None):
+        if image is None:
+            # display image if image is not [0] array
+            if isinstance(self.current_img, np.ndarray):
+                self.pyramid.set_image(self.current_img)
+                self.ui.imageView.clear_preview()
+            return
+
+        rgb = cv2.cvtColor(image, cv2.COLOR_HSV2RGB)  # preview is only as large as the visible region on screen
+        self.ui.imageView.set_preview(rgb, region)
+
+    # proxy_image returns a copy of the low resolution proxy of the region of the image visible in the image view,
+    # sized to the region on screen (never larger than the image), the proxy is computed once for each image
+    # blurred/sharpened and view position and reused while the slider is dragged
+    def proxy_image(self, image):
+        region = self.ui.imageView.visible_region()
+        scale = min(self.ui.imageView.zoom, 1.0)  # ratio of proxy size to image size
+
+        if self.proxy_source is not image or self.proxy_region != region or self.proxy_scale != scale:
+            x0, y0, x1, y1 = region
+            proxy_size = (max(1, int(round((x1 - x0) * scale))), max(1, int(round((y1 - y0) * scale))))
+
+            self.proxy_img = cv2.resize(image[y0:y1, x0:x1], proxy_size, interpolation=cv2.INTER_AREA)
+            self.proxy_source = image
+            self.proxy_region = region
+            self.proxy_scale = scale
+
+        return self.proxy_img.copy()
+
+    # finish_preview computes the full resolution image for the operation shown only on the proxy image
+    # called on slider release
+    def finish_preview(self):
+        if self.preview_code == 4:
+            self.blur(full_resolution=True)
+        elif self.preview_code == 5:
+            self.sharpen(full_resolution=True)
+
+    # finish_pending computes the full resolution image of a preview and waits for background operations
+    # to complete, called before any other operation uses the current image
+    def finish_pending(self):
+        self.finish_preview()
+        self.job_runner.flush()
 
     # enable_options enable all buttons and sliders in the window. Only Open button is enabled on start
     # Undo button remains disabled until an operation is performed
     def enable_options(self):
         self.ui.histogramEqualizationButton.setEnabled(True)
+        self.ui.adaptiveEqualizationButton.setEnabled(True)
         self.ui.gammaCorrectionButton.setEnabled(True)
         self.ui.logTransformButton.setEnabled(True)
 
@@ -316,7 +670,7 @@ class ImageEditorClass(QMainWindow):
 
         self.ui.saveImageButton.setEnabled(True)
         self.ui.undo_allButton.setEnabled(True)
-        self.ui.undoButton.setEnabled(False)
+        self.update_history_buttons()
 
         self.ui.viewHistogramButton.setEnabled(True)
         self.ui.detectEdgeButton.setEnabled(True)
@@ -341,20 +695,57 @@ class ImageEditorClass(QMainWindow):
         # reset values of blur and sharpen image class variables
         self.img_blur = [0]
         self.img_sharp = [0]
-
-        # enable Undo button only if an operation was performed previosly
-        # i.e. current operation code is a valid code
-        if (self.current_code >= 0) and not self.ui.undoButton.isEnabled():
-            self.ui.undoButton.setEnabled(True)
-
-    # updating the previous image class variable with current image
-    def update_previous_image(self):
-        self.prev_img = self.current_img.copy()
+        self.proxy_source = None
+        self.preview_code = -1
 
 
 # initialize the ImageEditorClass and run the application
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    myapp = ImageEditorClass()
+    parser = argparse.ArgumentParser(description='Basic image editor.')
+    parser.add_argument('--profile', action='store_true',
+                        help='time every handler and image processing method and show the last operation in the '
+                             'status bar')
+    parser.add_argument('--profile-output', default=None, help='file the profile is written to on exit')
+    parser.add_argument('--profile-format', choices=('chrome', 'json'), default='chrome',
+                        help='Chrome trace (for chrome://tracing or Perfetto) or plain JSON list of events')
+    parser.add_argument('--startup-time', action='store_true', help='print time taken to show the window')
+    parser.add_argument('--backend', choices=BACKENDS, default='thread',
+                        help='how blur, sharpen and edge detection run the strips of the image: in the GUI process, '
+                             'on threads (default) or on worker processes')
+    parser.add_argument('--quality', type=int, default=None, help='quality of saved JPEG and WebP images (0-100)')
+    parser.add_argument('--png-compression', type=int, default=None,
+                        help='compression level of saved PNG images (0-9, higher is smaller and slower)')
+    parser.add_argument('--progressive', action='store_true', help='save JPEG images as progressive')
+    args, qt_args = parser.parse_known_args()
+
+    profiler = None
+    if args.profile or args.profile_output:
+        # methods are only wrapped when profiling, otherwise the application runs the original methods
+        profiler = Profiler()
+        profiler.enable(classes=(ImageEditorClass, ImageProcessing, ImagePyramid, UndoHistory),
+                        functions=((cv2, 'cvtColor'), (cv2, 'resize'), (cv2, 'imread'), (cv2, 'imencode')))
+
+    if args.backend != 'thread':
+        ImageEditorClass.img_object.set_backend(args.backend)
+
+    ImageEditorClass.save_options = {'quality': args.quality, 'compression': args.png_compression,
+                                     'progressive': args.progressive}
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    myapp = ImageEditorClass(profiler=profiler)
     myapp.showMaximized()
-    sys.exit(app.exec_())
+
+    # timers fire once the event loop has painted the window
+    if args.startup_time:
+        QTimer.singleShot(0, myapp.show_startup_time)
+    status = app.exec_()
+
+    myapp.image_writer.close()  # images still being saved are written before exiting
+
+    if profiler is not None and args.profile_output:
+        if args.profile_format == 'chrome':
+            profiler.export_chrome_trace(args.profile_output)
+        else:
+            profiler.export_json(args.profile_output)
+
+    sys.exit(status)
@@ -0,0 +1,152 @@
+import numpy as np  # used for handling array operations
+
+from image_processing import ImageProcessing  # used for the image processing operations
+
+
+# class recording a chain of ImageProcessing operations as nodes and computing the whole chain in as few passes
+# over the image as possible:
+#   consecutive point operations (lookups) are composed into a single lookup,
+#   the lookup before a neighbourhood filter is applied on the strip read by the filter,
+#   consecutive neighbourhood filters are computed strip by strip in one tiled pass, each strip is read with the
+#   halos of all filters added up so that it is never written back to the whole image between the filters
+# histogram equalization depends on the histogram of its input, which is known without computing the image only
+# when no neighbourhood filter comes before it in the pass, so an equalization after a filter starts a new pass.
+# adaptive histogram equalization needs the histograms of whole tiles and is always a pass of its own
+class Pipeline(object):
+
+    # operations computed with a 256 entry lookup
+    point_operations = ('histogram_equalization', 'gamma_correction', 'log_transform', 'apply_lut')
+
+    # operations computed from neighbouring rows of each pixel, name => method computing a whole frame (or strip)
+    neighbourhood_operations = {'blur': 'blur_frame', 'sharp': 'sharp_frame', 'edge_detection': 'edge_detection_frame'}
+
+    # operations computed on the whole image, ending the pass before them
+    global_operations = ('adaptive_histogram_equalization',)
+
+    def __init__(self, operations=(), img_object=None):
+        self.img_object = img_object or ImageProcessing()  # object of ImageProcessing running the operations
+        self.nodes = []  # list of (operation, args) in order
+
+        for operation, args in operations:
+            self.add(operation, *args)
+
+    # appending the operation (name of an ImageProcessing method) with args to the chain
+    def add(self, operation, *args):
+
+        if (operation not in self.point_operations and operation not in self.neighbourhood_operations
+                and operation not in self.global_operations):
+            raise ValueError("unknown operation '%s'" % operation)
+
+        self.nodes.append((operation, args))
+        return self
+
+    # splitting the nodes into the lists of nodes computed in each pass over the image
+    def stages(self):
+
+        stages = [[]]
+
+        for operation, args in self.nodes:
+            stage = stages[-1]
+
+            if operation in self.global_operations:
+                stages += [[(operation, args)], []]
+            elif operation == 'histogram_equalization' and any(node in self.neighbourhood_operations
+                                                                for node, _ in stage):
+                stages.append([(operation, args)])  # histogram after the filters is not known before the pass
+            else:
+                stage.append((operation, args))
+
+        return [stage for stage in stages if stage]
+
+    # returning True if the lookups of stage depend on the histogram of its input
+    def needs_histogram(self, stage):
+        return any(operation == 'histogram_equalization' for operation, _ in stage)
+
+    # composing the nodes of stage into (filters, lut), filters is a list of (lookup applied on the input of the
+    # filter or None, operation, args) and lut is the lookup applied on the output of the last filter (or on the
+    # input when there are no filters) or None
+    # histogram is the histogram of the stage input, needed when the stage has an equalization
+    def fuse(self, stage, histogram=None):
+
+        filters = []
+        lut = None  # lookup of the point operations since the last filter
+
+        for operation, args in stage:
+            if operation in self.neighbourhood_operations:
+                filters.append((lut, operation, args))
+                lut = None
+                continue
+
+            if operation == 'histogram_equalization':
+                # histogram of the input mapped through the lookups before the equalization
+                step = self.img_object.equalization_lut(histogram if lut is None else self.map_histogram(histogram,
+                                                                                                          lut))
+            elif operation == 'apply_lut':
+                step = args[0]
+            else:
+                step = self.img_object.point_lut(operation, None, *args)
+
+            lut = step if lut is None else self.compose(lut, step)
+
+        return filters, lut
+
+    # returning the lookup of first followed by second, each is a 256 entry lookup or one lookup per image of a
+    # stack (shape (..., 256))
+    def compose(self, first, second):
+
+        if second.ndim == 1:
+            return np.take(second, first)
+
+        first = np.broadcast_to(first, second.shape).astype(np.intp)
+        return np.take_along_axis(second, first, axis=-1)
+
+    # mapping histogram (..., 256) through lut, output value lut[v] of each image gets the count of v
+    def map_histogram(self, histogram, lut):
+
+        count = int(np.prod(histogram.shape[:-1]))  # no. of images in the stack
+        values = np.broadcast_to(lut, histogram.shape).reshape(count, 256) + 256 * np.arange(count).reshape(-1, 1)
+
+        return np.bincount(values.ravel(), weights=histogram.ravel(),
+                           minlength=256 * count).reshape(histogram.shape)
+
+    # no. of neighbouring rows needed on each side of a strip for computing all filters passed on it
+    def halo(self, filters):
+        return sum(self.img_object.halo(operation, *args) for _, operation, args in filters)
+
+    # computing the filters and the output lookup on the whole frame (or strip) passed in the calling thread
+    # each filter is computed on all rows of the strip, rows which are wrong because the strip lacks their
+    # neighbours are within the halo and are dropped
+    def stage_frame(self, image, filters, lut):
+
+        for input_lut, operation, args in filters:
+            if input_lut is not None:
+                image = self.img_object.apply_lut(image, input_lut)
+            image = np.uint8(getattr(self.img_object, self.neighbourhood_operations[operation])(image, *args))
+
+        if lut is not None:
+            image = self.img_object.apply_lut(image, lut)
+
+        return image  # return the computed image
+
+    # computing one stage on the image with the tile scheduler
+    def run_stage(self, image, stage):
+
+        operation, args = stage[0]
+        if operation in self.global_operations:
+            return np.uint8(getattr(self.img_object, operation)(image, *args))
+
+        histogram = self.img_object.histograms(image) if self.needs_histogram(stage) else None
+        filters, lut = self.fuse(stage, histogram)
+
+        if not filters:
+            return self.img_object.apply_lut(image, lut)  # point operations only, a single gather
+
+        return self.img_object.tile_scheduler.run(self.stage_frame, image, self.halo(filters), filters, lut)
+
+    # computing the chain on the image (or stack of images) passed, returns the uint8 output
+    def run(self, image):
+
+        for stage in self.stages():
+            image = self.run_stage(image, stage)
+
+        return image  # return the computed image
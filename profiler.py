@@ -0,0 +1,171 @@
+import itertools  # used for numbering events
+import json  # used for exporting events
+import threading  # used for keeping the call stack of each thread
+import time  # used for measuring durations
+import tracemalloc  # used for measuring allocated bytes
+from collections import deque  # used as the ring buffer of events
+from functools import wraps  # used for keeping names of wrapped functions
+from inspect import isfunction  # used for finding the methods of a class
+
+
+# class recording duration and allocated bytes of every call of the methods and functions it instruments
+# methods are replaced with timing wrappers only while the profiler is enabled and the original methods are put
+# back when it is disabled, so there is no overhead at all when profiling is off
+# each finished call is stored as an event in a ring buffer holding the last capacity events
+class Profiler(object):
+
+    capacity = 100000  # no. of events kept, oldest events are dropped first
+
+    def __init__(self, capacity=None, memory=True):
+        if capacity:
+            self.capacity = capacity
+        self.memory = memory  # measuring bytes allocated by each call with tracemalloc
+
+        self.events = deque(maxlen=self.capacity)
+        self.patched = []  # (owner, name, original attribute) of every instrumented method/function
+        self.ids = itertools.count()
+        self.stacks = threading.local()  # ids of the calls running in each thread, innermost last
+        self.origin = time.perf_counter()  # time of event timestamp 0
+        self.started_tracing = False  # tracemalloc was started by the profiler
+
+    def is_enabled(self):
+        return len(self.patched) > 0
+
+    # instrumenting the methods defined by each class in classes (not inherited ones, not __special__ ones)
+    # and the functions passed as (module, name), e.g. (cv2, 'cvtColor')
+    def enable(self, classes=(), functions=()):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+        for cls in classes:
+            for name, attribute in list(vars(cls).items()):
+                if isfunction(attribute) and not name.startswith('__'):
+                    self.patch(cls, name, '%s.%s' % (cls.__name__, name))
+
+        for module, name in functions:
+            self.patch(module, name, '%s.%s' % (module.__name__, name))
+
+    # putting back all original methods and functions
+    def disable(self):
+        while self.patched:
+            owner, name, original = self.patched.pop()
+            setattr(owner, name, original)
+
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    # replacing attribute name of owner with a wrapper recording each call as event label
+    def patch(self, owner, name, label):
+        original = getattr(owner, name)
+        stored = vars(owner).get(name, original)  # staticmethod/classmethod objects are put back as they were
+
+        @wraps(original)
+        def timed(*args, **kwargs):
+            return self.call(label, original, args, kwargs)
+
+        self.patched.append((owner, name, stored))
+        setattr(owner, name, timed)
+
+    # calling function with args and recording the event
+    def call(self, label, function, args, kwargs):
+        stack = getattr(self.stacks, 'ids', None)
+        if stack is None:
+            stack = self.stacks.ids = []
+
+        event_id = next(self.ids)
+        parent = stack[-1] if stack else None
+        stack.append(event_id)
+
+        tracing = self.memory and tracemalloc.is_tracing()
+        before = tracemalloc.get_traced_memory()[0] if tracing else 0
+        start = time.perf_counter()
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            allocated = tracemalloc.get_traced_memory()[0] - before if tracing else 0
+            stack.pop()
+
+            # appending to a deque is thread safe, events of pool threads need no lock
+            self.events.append({
+                'id': event_id, 'parent': parent, 'depth': len(stack), 'name': label,
+                'thread': threading.current_thread().name, 'start': start - self.origin,
+                'duration': end - start, 'bytes': allocated,
+            })
+
+    # removing all events
+    def clear(self):
+        self.events.clear()
+
+    # returning the events of the last operation, i.e. the last top level call of one of the entry points
+    # (e.g. a button handler) and every call started after it on any thread, in order of start
+    def last_operation(self, entry_points):
+        events = list(self.events)
+
+        start = None
+        for event in reversed(events):
+            if event['depth'] == 0 and event['name'] in entry_points:
+                start = event['start']
+                break
+
+        if start is None:
+            return []
+
+        return sorted((event for event in events if event['start'] >= start), key=lambda event: event['start'])
+
+    # one line summary of the events passed, time of the top level calls with the time of their direct children,
+    # calls of the same function are added up (e.g. strips of an image computed on several threads)
+    # e.g. "ImageEditorClass.blur 0.4 ms | ImageEditorClass.slider_operation 21.0 ms (blur 19.6 ms, make_entry 1.2 ms)"
+    def summary(self, events):
+        ids = {}  # id of each top level call => its name
+        totals = {}  # name of top level function => [duration, bytes, {child name => duration}], in order of start
+
+        for event in events:
+            if event['depth'] == 0:
+                ids[event['id']] = event['name']
+                total = totals.setdefault(event['name'], [0.0, 0, {}])
+                total[0] += event['duration']
+                total[1] += event['bytes']
+
+        for event in events:
+            if event['parent'] in ids:
+                inner = totals[ids[event['parent']]][2]
+                name = event['name'].split('.')[-1]
+                inner[name] = inner.get(name, 0.0) + event['duration']
+
+        parts = []
+        for name, (duration, allocated, inner) in totals.items():
+            text = '%s %.1f ms' % (name, duration * 1e3)
+            if allocated:
+                text += ' %+.1f MB' % (allocated / 2 ** 20)
+            if inner:
+                text += ' (%s)' % ', '.join('%s %.1f ms' % (child, seconds * 1e3) for child, seconds in inner.items())
+            parts.append(text)
+
+        return ' | '.join(parts)
+
+    # writing all events to path as a JSON list
+    def export_json(self, path):
+        with open(path, 'w') as output_file:
+            json.dump(list(self.events), output_file, indent=1)
+
+    # writing all events to path in Chrome trace format, viewable in chrome://tracing or Perfetto
+    def export_chrome_trace(self, path):
+        threads = {}  # thread name => trace thread id
+
+        trace = []
+        for event in self.events:
+            tid = threads.setdefault(event['thread'], len(threads))
+            trace.append({
+                'name': event['name'], 'cat': event['name'].split('.')[0], 'ph': 'X', 'pid': 0, 'tid': tid,
+                'ts': event['start'] * 1e6, 'dur': event['duration'] * 1e6, 'args': {'bytes': event['bytes']},
+            })
+
+        for name, tid in threads.items():
+            trace.append({'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': tid, 'args': {'name': name}})
+
+        with open(path, 'w') as output_file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, output_file)
@@ -0,0 +1,143 @@
+from collections import OrderedDict  # used for keeping tiles in least recently used order
+
+import cv2  # used for colorspace conversion and resizing
+import numpy as np  # used for handling array operations
+
+
+# class building RGB tiles of a multi-resolution (mipmap) pyramid of an HSV image on demand
+# level k holds the image scaled by 1 / 2^k, split into tile_size x tile_size tiles
+# a tile of level k >= 1 is computed from the image subsampled by 2^(k-1) and area averaged by 2, so it reads
+# only 4 times as many pixels as it has and tiles are independent of each other
+# H and S never change while editing, so the subsampled image of each level from 2 up is kept with its H and S
+# and a tile computed again after an edit only subsamples the V channel (about 1/4 of the image size in memory)
+class ImagePyramid(object):
+
+    tile_size = 256  # width and height of the tiles in pixels
+
+    max_tiles = 1024  # no. of tiles kept in memory, about 200 MB of RGB tiles
+
+    def __init__(self, image=None):
+        self.tiles = OrderedDict()  # (level, tile row, tile column) => RGB tile, most recently used last
+        self.planes = {}  # level => subsampled image holding the H and S of the image, V is refreshed per tile
+        self.image = None
+        if image is not None:
+            self.set_image(image)
+
+    # using image (HSV) as the source of the pyramid, when it replaces an image of the same shape only the
+    # tiles of pixels which differ are dropped, otherwise all tiles are dropped
+    def set_image(self, image):
+        if image is self.image:
+            return
+
+        if self.image is not None and self.image.shape == image.shape:
+            self.invalidate_changed(self.image, image)
+        else:
+            self.tiles.clear()
+        self.planes.clear()  # H and S of another image
+        self.image = image
+
+    # using image (HSV) as the source of the pyramid in place of an image of the same shape with the same hue and
+    # saturation (e.g. the current image after an edit of its V channel), only the V channels are compared
+    # value is the V channel the image is about to get, by default its own
+    def replace_value(self, image, value=None):
+        if value is None:
+            if image is self.image:
+                return
+            value = image[:, :, 2]
+
+        if self.image is not None and self.image.shape == image.shape:
+            self.invalidate_changed(self.image[:, :, 2], value)
+        else:
+            self.tiles.clear()
+            self.planes.clear()
+        self.image = image
+
+    # no. of levels, the last level fits in a single tile
+    def levels(self):
+        size = max(self.image.shape[0], self.image.shape[1])
+        levels = 1
+        while size > self.tile_size:
+            size = (size + 1) // 2
+            levels += 1
+        return levels
+
+    # computing (height, width) of the image at the level passed
+    def level_shape(self, level):
+        scale = 2 ** level
+        return -(-self.image.shape[0] // scale), -(-self.image.shape[1] // scale)
+
+    # computing (rows, columns) of tiles at the level passed
+    def grid(self, level):
+        height, width = self.level_shape(level)
+        return -(-height // self.tile_size), -(-width // self.tile_size)
+
+    # returning the RGB tile at tile row ty and tile column tx of the level, computing it if it is not cached
+    def tile(self, level, ty, tx):
+        key = (level, ty, tx)
+        tile = self.tiles.get(key)
+
+        if tile is None:
+            tile = self.compute_tile(level, ty, tx)
+            self.tiles[key] = tile
+            if len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+        else:
+            self.tiles.move_to_end(key)
+
+        return tile
+
+    # computing the RGB tile at tile row ty and tile column tx of the level from the HSV image
+    def compute_tile(self, level, ty, tx):
+        scale = 2 ** level
+        span = self.tile_size * scale  # no. of image pixels covered by the tile
+
+        region = self.image[ty * span:(ty + 1) * span, tx * span:(tx + 1) * span]
+
+        if level == 0:
+            return cv2.cvtColor(np.ascontiguousarray(region), cv2.COLOR_HSV2RGB)
+
+        # subsampling to twice the tile resolution and area averaging the RGB pixels by 2
+        step = scale // 2
+        if step == 1:
+            subsampled = np.ascontiguousarray(region)
+        else:
+            # H and S are kept in the subsampled image of the level, only V is subsampled again
+            if level not in self.planes:
+                self.planes[level] = np.ascontiguousarray(self.image[::step, ::step])
+            rows = slice(ty * span // step, (ty + 1) * span // step)
+            columns = slice(tx * span // step, (tx + 1) * span // step)
+
+            subsampled = self.planes[level][rows, columns]
+            subsampled[:, :, 2] = region[::step, ::step, 2]
+
+        rgb = cv2.cvtColor(subsampled, cv2.COLOR_HSV2RGB)
+        size = (max(1, -(-region.shape[1] // scale)), max(1, -(-region.shape[0] // scale)))
+
+        return cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+
+    # dropping the tiles of all levels which cover the image rectangle rows y0 to y1 and columns x0 to x1
+    def invalidate(self, y0, y1, x0, x1):
+        for level, ty, tx in list(self.tiles):
+            span = self.tile_size * 2 ** level
+            if ty * span < y1 and (ty + 1) * span > y0 and tx * span < x1 and (tx + 1) * span > x0:
+                del self.tiles[(level, ty, tx)]
+
+    # dropping only the tiles whose pixels differ between the image (or its V channel) before and after an edit
+    def invalidate_changed(self, before, after):
+        if not self.tiles:
+            return
+
+        changed = np.not_equal(before, after)
+        if changed.ndim == 3:
+            changed = changed.any(axis=2)
+
+        # reducing the changed pixels to one flag per level 0 tile
+        row_starts = np.arange(0, changed.shape[0], self.tile_size)
+        column_starts = np.arange(0, changed.shape[1], self.tile_size)
+        changed = np.logical_or.reduceat(np.logical_or.reduceat(changed, row_starts, axis=0), column_starts, axis=1)
+
+        # a tile of level k covers 2^k x 2^k tiles of level 0
+        for level, ty, tx in list(self.tiles):
+            scale = 2 ** level
+            if changed[ty * scale:(ty + 1) * scale, tx * scale:(tx + 1) * scale].any():
+                del self.tiles[(level, ty, tx)]
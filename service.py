@@ -0,0 +1,536 @@
+# local HTTP service running ImageProcessing operations for other programs on the same machine
+# example:
+#   python service.py --port 8610 --workers 4
+# endpoints:
+#   POST /process   JSON {"recipe": "equalize,blur=1", "shape": [H, W], "input": name, "output": name} where input
+#                   and output are shared memory blocks created by the caller, the output is written in place
+#                   and no pixel data goes through the socket (see ServiceClient.process)
+#   POST /process?recipe=equalize,blur=1&shape=H,W   with the raw uint8 pixels as body, answered with the raw
+#                   output pixels, for callers which cannot use shared memory
+#   GET /metrics    request and queue latency histograms, batch sizes and queue depth in Prometheus text format
+#   GET /health
+# images are uint8 arrays of any shape with rows and columns on the last two axes (e.g. the V channel of an HSV
+# image, or a stack of them), recipes are written as for batch.py
+
+import argparse  # used for parsing command line arguments
+import itertools  # used for numbering batches
+import json  # used for request and response bodies
+import multiprocessing  # used for the pre-forked worker processes
+import os  # used for finding no. of cpu cores
+import queue  # used for the queue of pending requests
+import sys  # used for exit codes and reporting
+import threading  # used for the batcher and collector threads
+import time  # used for measuring latency
+import traceback  # used for reporting errors of workers
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # used for serving requests
+from urllib.parse import parse_qs, urlencode, urlsplit  # used for building and parsing request paths
+from urllib.request import Request, urlopen  # used by the client
+
+import numpy as np  # used for handling array operations
+
+import shared  # used for passing images between processes in shared memory
+from batch import parse_recipe  # used for parsing the operation recipe
+from image_processing import ImageProcessing  # used for the image processing operations
+from pipeline import Pipeline  # used for computing chained operations in a single pass
+
+
+# worker process loop, computing batches of tasks until None is received
+# a task is (batch id, shape, recipe, list of (input block name, output block name)), all images of a batch have
+# the same shape and recipe and are computed as one stack
+# the result is (batch id, list of error messages, None for requests computed), a request whose blocks cannot be
+# attached fails alone and the other requests of the batch are still computed
+def worker_main(tasks, results, threads):
+
+    img_object = ImageProcessing(threads)
+    pipelines = {}  # recipe => Pipeline, recipes sent again reuse their parsed pipeline
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+
+        batch_id, shape, recipe, buffers = task
+        errors = [None] * len(buffers)
+        blocks = {}  # index of the request => (input block, output block) of requests whose blocks are attached
+
+        for i, (input_name, output_name) in enumerate(buffers):
+            try:
+                blocks[i] = attach_blocks(input_name, output_name, shape)
+            except Exception:
+                errors[i] = traceback.format_exc().strip().splitlines()[-1]
+
+        try:
+            if recipe not in pipelines:
+                pipelines[recipe] = Pipeline(parse_recipe(recipe), img_object)
+
+            if blocks:
+                run_batch(pipelines[recipe], shape, list(blocks.values()))
+        except Exception:
+            error = traceback.format_exc().strip().splitlines()[-1]
+            for i in blocks:
+                errors[i] = error
+
+        # views of the blocks are released with the frame of run_batch, so the blocks can be closed
+        for input_block, output_block in blocks.values():
+            input_block.close()
+            output_block.close()
+
+        results.put((batch_id, errors))
+
+
+# attaching the input and output blocks of a request and checking that both hold an image of shape
+def attach_blocks(input_name, output_name, shape):
+
+    attached = []
+    try:
+        for name in (input_name, output_name):
+            attached.append(shared.attach(name))
+            shared.view(attached[-1], shape)  # raises if the block is too small
+    except Exception:
+        for block in attached:
+            block.close()
+        raise
+
+    return attached[0], attached[1]
+
+
+# computing pipeline on the images in the input blocks of blocks (list of (input block, output block)) as one
+# stack and writing each output to its output block
+def run_batch(pipeline, shape, blocks):
+
+    images = [shared.view(input_block, shape) for input_block, _ in blocks]
+    output = pipeline.run(images[0] if len(images) == 1 else np.stack(images))
+
+    for i, (_, output_block) in enumerate(blocks):
+        shared.view(output_block, shape)[...] = output if len(blocks) == 1 else output[i]
+
+
+# class counting observed values in cumulative buckets, written in Prometheus histogram format
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets  # upper bounds of the buckets in increasing order
+        self.counts = [0] * len(buckets)  # no. of values <= each bound
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    # returning the lines of the histogram in Prometheus text format
+    def lines(self, name, description):
+        with self.lock:
+            lines = ['# HELP %s %s' % (name, description), '# TYPE %s histogram' % name]
+            lines += ['%s_bucket{le="%g"} %d' % (name, bound, count) for bound, count in zip(self.buckets,
+                                                                                             self.counts)]
+            lines += ['%s_bucket{le="+Inf"} %d' % (name, self.count), '%s_sum %.6f' % (name, self.sum),
+                      '%s_count %d' % (name, self.count)]
+        return lines
+
+
+# request waiting for its image to be computed
+class PendingRequest(object):
+
+    def __init__(self, shape, recipe, input_name, output_name):
+        self.shape = tuple(shape)
+        self.recipe = recipe
+        self.input_name = input_name
+        self.output_name = output_name
+
+        self.arrival = time.perf_counter()
+        self.error = None  # error message of the worker, None on success
+        self.done = threading.Event()
+        self.abandoned = False  # the caller stopped waiting, the request is not sent to a worker any more
+
+    # requests with the same key are computed together as one stack
+    def key(self):
+        return self.shape, self.recipe
+
+
+# class running requests on a pool of worker processes started once with the service
+# requests arriving within batch_window seconds of each other with the same shape and recipe are sent to a worker
+# as one batch (up to max_batch), at most 2 batches per worker are sent at a time and requests arriving while
+# all workers are busy wait in the queue, so batches grow with the load
+class ImageService(object):
+
+    batch_window = 0.005  # seconds a request waits for others to batch with
+    max_batch = 16  # largest no. of requests in a batch
+
+    latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    batch_buckets = (1, 2, 4, 8, 16, 32, 64)
+
+    def __init__(self, workers=None, threads=1, batch_window=None, max_batch=None):
+        self.workers = workers or os.cpu_count() or 1  # no. of worker processes
+        self.threads = threads  # no. of threads used by each worker process
+        if batch_window is not None:
+            self.batch_window = batch_window
+        if max_batch:
+            self.max_batch = max_batch
+
+        self.pending = queue.Queue()  # requests not yet sent to a worker
+        self.in_flight = {}  # batch id => requests of the batch sent to a worker
+        self.slots = threading.Semaphore(2 * self.workers)  # batches which may be sent to workers at a time
+        self.batch_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.processes = []
+        self.threads_started = []
+
+        self.request_seconds = Histogram(self.latency_buckets)  # arrival to response
+        self.queue_seconds = Histogram(self.latency_buckets)  # arrival to being sent to a worker
+        self.batch_sizes = Histogram(self.batch_buckets)
+        self.requests_total = {'ok': 0, 'error': 0}
+
+    # forking the worker processes and starting the batcher and collector threads
+    # workers are forked before any thread of the service is started
+    def start(self):
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+
+        for _ in range(self.workers):
+            process = context.Process(target=worker_main, args=(self.tasks, self.results, self.threads))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+
+        for target in (self.batcher, self.collector):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self.threads_started.append(thread)
+
+    # stopping the workers and the threads
+    def stop(self):
+        self.pending.put(None)  # stops the batcher
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(5)
+        self.results.put(None)  # stops the collector
+
+        for thread in self.threads_started:
+            thread.join(5)
+
+    # no. of requests waiting or being computed
+    def queue_depth(self):
+        with self.lock:
+            return self.pending.qsize() + sum(len(requests) for requests in self.in_flight.values())
+
+    # computing the recipe on the image in the shared memory block input_name into the block output_name, waits
+    # until the output is written and returns None, or the error message
+    def process(self, shape, recipe, input_name, output_name, timeout=60.0):
+        request = PendingRequest(shape, recipe, input_name, output_name)
+        self.pending.put(request)
+
+        if not request.done.wait(timeout):
+            # the caller may free its blocks once this returns, so a request still queued must not reach a worker
+            request.abandoned = True
+            request.error = 'timed out after %g s' % timeout
+
+        self.request_seconds.observe(time.perf_counter() - request.arrival)
+        with self.lock:
+            self.requests_total['error' if request.error else 'ok'] += 1
+
+        return request.error
+
+    # batcher thread, grouping pending requests by key and sending each group to the workers
+    def batcher(self):
+        while True:
+            request = self.pending.get()
+            if request is None:
+                return
+
+            # collecting requests arriving within the batch window of the first one
+            requests = [request]
+            deadline = request.arrival + self.batch_window
+            stopping = False
+            while len(requests) < self.max_batch * 4:
+                try:
+                    request = self.pending.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                requests.append(request)
+
+            groups = {}
+            for request in requests:
+                if not request.abandoned:
+                    groups.setdefault(request.key(), []).append(request)
+
+            for (shape, recipe), group in groups.items():
+                for start in range(0, len(group), self.max_batch):
+                    self.dispatch(shape, recipe, group[start:start + self.max_batch])
+
+            if stopping:
+                return
+
+    # sending a batch of requests to the workers, waiting while all batch slots are taken
+    # requests abandoned while waiting for a slot are dropped
+    def dispatch(self, shape, recipe, requests):
+        self.slots.acquire()
+
+        requests = [request for request in requests if not request.abandoned]
+        if not requests:
+            self.slots.release()
+            return
+
+        batch_id = next(self.batch_ids)
+        with self.lock:
+            self.in_flight[batch_id] = requests
+
+        now = time.perf_counter()
+        for request in requests:
+            self.queue_seconds.observe(now - request.arrival)
+        self.batch_sizes.observe(len(requests))
+
+        buffers = [(request.input_name, request.output_name) for request in requests]
+        self.tasks.put((batch_id, shape, recipe, buffers))
+
+    # collector thread, completing the requests of each batch finished by a worker
+    def collector(self):
+        while True:
+            result = self.results.get()
+            if result is None:
+                return
+
+            batch_id, errors = result
+            with self.lock:
+                requests = self.in_flight.pop(batch_id)
+            self.slots.release()
+
+            for request, error in zip(requests, errors):
+                request.error = error
+                request.done.set()
+
+    # returning the metrics in Prometheus text format
+    def metrics(self):
+        with self.lock:
+            totals = dict(self.requests_total)
+
+        lines = self.request_seconds.lines('image_service_request_seconds', 'Time from arrival to response.')
+        lines += self.queue_seconds.lines('image_service_queue_seconds', 'Time from arrival to a worker.')
+        lines += self.batch_sizes.lines('image_service_batch_size', 'No. of requests computed together.')
+        lines += ['# HELP image_service_queue_depth Requests waiting or being computed.',
+                  '# TYPE image_service_queue_depth gauge', 'image_service_queue_depth %d' % self.queue_depth()]
+        lines += ['# HELP image_service_requests_total Requests answered.',
+                  '# TYPE image_service_requests_total counter']
+        lines += ['image_service_requests_total{status="%s"} %d' % (status, count)
+                  for status, count in totals.items()]
+        lines += ['# HELP image_service_workers Worker processes.', '# TYPE image_service_workers gauge',
+                  'image_service_workers %d' % self.workers]
+
+        return '\n'.join(lines) + '\n'
+
+
+# checking the image shape of a request (list of sizes, e.g. [H, W]) and returning it as a list of ints
+# rows and columns are needed, and every size must be positive
+def parse_shape(sizes):
+
+    if isinstance(sizes, str) or not isinstance(sizes, (list, tuple)):
+        raise ValueError('shape must be a list of sizes, e.g. [H, W], not %r' % (sizes,))
+
+    shape = [int(size) for size in sizes]
+    if len(shape) < 2 or min(shape) <= 0:
+        raise ValueError('shape %s must have at least rows and columns, all positive' % shape)
+
+    return shape
+
+
+# checking that the shared memory block name exists and holds at least nbytes bytes
+def check_block(name, nbytes):
+
+    if not isinstance(name, str):
+        raise ValueError('shared memory block name must be a string, not %r' % (name,))
+    try:
+        block = shared.attach(name)
+    except OSError:
+        raise ValueError("shared memory block '%s' does not exist" % name)
+
+    size = block.size
+    block.close()
+    if size < nbytes:
+        raise ValueError("shared memory block '%s' has %d bytes, the image needs %d" % (name, size, nbytes))
+
+
+# handler of the HTTP requests of the service, the ImageService is the service attribute of the server
+class ServiceHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'  # keeping connections open between requests of a client
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/metrics':
+            self.reply(200, self.server.service.metrics().encode(), 'text/plain; version=0.0.4')
+        elif path == '/health':
+            self.reply(200, b'ok\n', 'text/plain')
+        else:
+            self.reply_error(404, 'unknown path %s' % path)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if url.path != '/process':
+            self.reply_error(404, 'unknown path %s' % url.path)
+            return
+
+        try:
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                self.process_shared(json.loads(body.decode()))
+            else:
+                self.process_bytes(parse_qs(url.query), body)
+        except (KeyError, ValueError, TypeError, AttributeError) as error:
+            # missing fields, or fields of the wrong type (e.g. a number as recipe)
+            self.reply_error(400, 'bad request: %s' % error)
+
+    # computing a request whose pixels are in shared memory blocks of the caller
+    def process_shared(self, request):
+        shape = parse_shape(request['shape'])
+        parse_recipe(request['recipe'])  # reporting bad recipes before they reach a worker
+
+        # reporting missing or too small blocks before they reach a worker
+        for name in (request['input'], request['output']):
+            check_block(name, int(np.prod(shape)))
+
+        error = self.server.service.process(shape, request['recipe'], request['input'], request['output'])
+        if error:
+            self.reply_error(500, error)
+        else:
+            self.reply(200, b'{"ok": true}', 'application/json')
+
+    # computing a request with the pixels in the body, copied to shared memory blocks owned by the service
+    def process_bytes(self, query, body):
+        shape = parse_shape(query['shape'][0].split(','))
+        recipe = query['recipe'][0]
+        parse_recipe(recipe)
+
+        if len(body) != int(np.prod(shape)):
+            raise ValueError('body has %d bytes, shape %s needs %d' % (len(body), shape, int(np.prod(shape))))
+
+        input_block, image = shared.create(shape)
+        output_block, output = shared.create(shape)
+        try:
+            image[...] = np.frombuffer(body, dtype=np.uint8).reshape(shape)
+            error = self.server.service.process(shape, recipe, input_block.name, output_block.name)
+            data = None if error else output.tobytes()
+        finally:
+            del image, output  # views of the blocks have to be released before closing them
+            for block in (input_block, output_block):
+                block.close()
+                block.unlink()
+
+        if error:
+            self.reply_error(500, error)
+        else:
+            self.reply(200, data, 'application/octet-stream')
+
+    def reply(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def reply_error(self, status, message):
+        self.reply(status, json.dumps({'ok': False, 'error': message}).encode(), 'application/json')
+
+    # requests are not logged unless the server is verbose
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+# starting the service and its HTTP server on host:port (port 0 picks a free port), returns the server
+# serve_forever() of the server answers requests, server_address gives the port
+def make_server(service, host='127.0.0.1', port=8610, verbose=False):
+
+    service.start()
+
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.verbose = verbose
+
+    return server
+
+
+# class calling the service from another process on the same machine
+class ServiceClient(object):
+
+    def __init__(self, url='http://127.0.0.1:8610', timeout=60.0):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def post(self, path, data, content_type):
+        request = Request(self.url + path, data=data, headers={'Content-Type': content_type})
+        with urlopen(request, timeout=self.timeout) as response:
+            return response.read()
+
+    # computing recipe on the uint8 image through shared memory, returns the output image
+    def process(self, image, recipe):
+        input_block, shared_image = shared.create(image.shape)
+        output_block, shared_output = shared.create(image.shape)
+        try:
+            shared_image[...] = image
+            request = {'recipe': recipe, 'shape': list(image.shape), 'input': input_block.name,
+                       'output': output_block.name}
+            self.post('/process', json.dumps(request).encode(), 'application/json')
+            return shared_output.copy()
+        finally:
+            del shared_image, shared_output  # views of the blocks have to be released before closing them
+            for block in (input_block, output_block):
+                block.close()
+                block.unlink()
+
+    # computing recipe on the uint8 image sent in the request body, returns the output image
+    def process_bytes(self, image, recipe):
+        path = '/process?' + urlencode({'recipe': recipe, 'shape': ','.join(str(size) for size in image.shape)})
+        data = self.post(path, np.ascontiguousarray(image, dtype=np.uint8).tobytes(), 'application/octet-stream')
+        return np.frombuffer(data, dtype=np.uint8).reshape(image.shape)
+
+    def metrics(self):
+        with urlopen(self.url + '/metrics', timeout=self.timeout) as response:
+            return response.read().decode()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve image editor operations over HTTP on this machine.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8610, help='port to listen on (default: 8610)')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='no. of worker processes (default: cores)')
+    parser.add_argument('--threads', type=int, default=1, help='no. of threads in each worker process')
+    parser.add_argument('--batch-window', type=float, default=ImageService.batch_window * 1e3,
+                        help='milliseconds a request waits for same sized requests to batch with (default: 5)')
+    parser.add_argument('--max-batch', type=int, default=ImageService.max_batch,
+                        help='largest no. of requests computed together (default: 16)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every request')
+    args = parser.parse_args(argv)
+
+    service = ImageService(args.workers, args.threads, args.batch_window / 1e3, args.max_batch)
+    server = make_server(service, args.host, args.port, args.verbose)
+    sys.stderr.write('serving on http://%s:%d with %d workers\n' % (server.server_address[0],
+                                                                    server.server_address[1], service.workers))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
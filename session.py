@@ -0,0 +1,337 @@
+# non-destructive editing session: the original image and the list of operations applied to its V channel are
+# saved as a small JSON project file, the image after each step is computed again when needed and cached in
+# memory and on disk under the hash of (input, operation, parameters)
+# example:
+#   python session.py portrait.json portrait_edited.jpg
+# renders the project with the intermediate results of earlier runs taken from the disk cache
+
+import argparse  # used for parsing command line arguments
+import hashlib  # used for content hashes of images and steps
+import json  # used for reading/writing project files
+import os  # used for handling file paths
+import sys  # used for exit codes and reporting
+import tempfile  # used for writing cache entries atomically
+import threading  # used for guarding the disk cache index
+from collections import OrderedDict  # used for keeping entries in least recently used order
+
+import cv2  # used for reading/writing images and colorspace conversion
+import numpy as np  # used for handling array operations
+
+from cache import ResultCache  # used for keeping recent results in memory
+from image_processing import ImageProcessing  # used for the image processing operations
+
+
+# operations a session can record, each takes the V channel and JSON serializable parameters
+OPERATIONS = ('histogram_equalization', 'gamma_correction', 'log_transform', 'blur', 'sharp', 'edge_detection',
+              'adaptive_histogram_equalization')
+
+PROJECT_EXTENSION = '.json'  # extension of project files
+
+
+# returning the hash of the content of the image passed
+def content_key(image):
+
+    digest = hashlib.sha256(('%s %s' % (image.shape, image.dtype)).encode())
+    digest.update(np.ascontiguousarray(image).data)
+
+    return digest.hexdigest()
+
+
+# returning the hash of the result of operation with args on the image with hash input_key
+def step_key(input_key, operation, args):
+    return hashlib.sha256(json.dumps([input_key, operation, list(args)]).encode()).hexdigest()
+
+
+# converting numpy scalars in args to python numbers so that they can be written to JSON
+def plain_args(args):
+    return tuple(arg.item() if isinstance(arg, np.generic) else arg for arg in args)
+
+
+# class caching arrays as .npy files named by their key in directory, with a limit on total bytes
+# least recently used files are removed first, the last use of a file is kept as its modification time so the
+# order survives restarts, and files are written under a temporary name and renamed so that processes sharing
+# the directory never read a partial file
+class DiskCache(object):
+
+    max_bytes = 1024 * 1024 * 1024  # bytes of files the cache may hold
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or os.path.join(os.path.expanduser('~'), '.cache', 'ee610-image-editor')
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.entries = OrderedDict()  # key => file size, most recently used last
+        self.nbytes = 0  # bytes held by all files
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        # indexing files of earlier runs in order of last use
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                status = os.stat(os.path.join(self.directory, name))
+                files.append((status.st_mtime, name[:-len('.npy')], status.st_size))
+
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.nbytes += size
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    # checking if an array is cached for key, without reading it
+    def contains(self, key):
+        with self.lock:
+            return key in self.entries
+
+    # returning the cached array for key (marking it most recently used), None if it is not cached
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+
+        try:
+            value = np.load(self.path(key))
+            os.utime(self.path(key))
+        except (IOError, OSError, ValueError):
+            # file was removed by another process sharing the directory, or is unreadable
+            with self.lock:
+                self.nbytes -= self.entries.pop(key, 0)
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return value
+
+    # storing value for key and removing least recently used files beyond the size limit,
+    # values larger than the whole limit are not stored
+    def put(self, key, value):
+        if value.nbytes > self.max_bytes:
+            return
+
+        descriptor, partial_path = tempfile.mkstemp(suffix='.partial', dir=self.directory)
+        with os.fdopen(descriptor, 'wb') as partial_file:
+            np.save(partial_file, value)
+        os.replace(partial_path, self.path(key))
+
+        with self.lock:
+            self.nbytes -= self.entries.pop(key, 0)
+            self.entries[key] = os.path.getsize(self.path(key))
+            self.nbytes += self.entries[key]
+
+            while self.nbytes > self.max_bytes:
+                evicted, size = self.entries.popitem(last=False)
+                self.nbytes -= size
+                if os.path.exists(self.path(evicted)):
+                    os.remove(self.path(evicted))
+
+    # returning the cached array for key, computing it with function(*args) and storing it if not cached
+    def get_or_compute(self, key, function, *args):
+        value = self.get(key)
+        if value is None:
+            value = function(*args)
+            self.put(key, value)
+        return value
+
+    # removing all files
+    def clear(self):
+        with self.lock:
+            for key in self.entries:
+                if os.path.exists(self.path(key)):
+                    os.remove(self.path(key))
+            self.entries.clear()
+            self.nbytes = 0
+
+
+# class holding the original image and the steps (operation, args) applied to its V channel in order
+# the key of the V channel after step i is the hash of the key after step i - 1 with the operation and args of
+# step i, so changing a step changes the keys of that step and of the steps after it only; the channel after a
+# step is taken from the memory cache, else from the disk cache, else computed from the closest earlier step
+# which is cached
+class Session(object):
+
+    version = 1  # version of the project file format
+
+    memory_bytes = 256 * 1024 * 1024  # bytes of channels kept in memory
+
+    def __init__(self, image_path, steps=(), disk_cache=None, img_object=None):
+        self.image_path = os.path.abspath(image_path)
+        self.steps = []  # list of (operation, args)
+        self.disk_cache = disk_cache  # None keeps intermediate channels in memory only
+        self.memory_cache = ResultCache(self.memory_bytes)
+        self.img_object = img_object or ImageProcessing()
+
+        self.image = None  # HSV original, read on first use
+        self.original_key = None  # hash of the V channel of the original
+        self.computed = 0  # no. of steps computed (not found in a cache) by the last call of channel
+
+        for operation, args in steps:
+            self.add(operation, *args)
+
+    # reading the original image, or using the HSV image passed when it is already loaded
+    def load_image(self, image=None):
+        if image is None:
+            image = cv2.imread(self.image_path, 1)
+            if image is None:
+                raise IOError("could not read image '%s'" % self.image_path)
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+        self.image = image
+        self.original_key = content_key(image[:, :, 2])
+
+    # checking that operation can be recorded and returning (operation, args) of the step
+    def make_step(self, operation, args):
+        if operation not in OPERATIONS:
+            raise ValueError("unknown operation '%s', expected one of %s" % (operation, ', '.join(OPERATIONS)))
+        return operation, plain_args(args)
+
+    # appending a step to the end of the session
+    def add(self, operation, *args):
+        self.steps.append(self.make_step(operation, args))
+
+    # replacing step index, steps after it are computed again when the result is next needed
+    def replace(self, index, operation, *args):
+        self.steps[index] = self.make_step(operation, args)
+
+    # removing step index
+    def remove(self, index):
+        del self.steps[index]
+
+    # keeping only the first count steps
+    def truncate(self, count):
+        del self.steps[count:]
+
+    # returning the keys of the V channel before the first step and after every step
+    def keys(self):
+        if self.image is None:
+            self.load_image()
+
+        keys = [self.original_key]
+        for operation, args in self.steps:
+            keys.append(step_key(keys[-1], operation, args))
+
+        return keys
+
+    # returning the cached V channel for key, None if it is in no cache
+    def cached(self, key):
+        channel = self.memory_cache.get(key)
+        if channel is None and self.disk_cache is not None:
+            channel = self.disk_cache.get(key)
+            if channel is not None:
+                self.memory_cache.put(key, channel)
+        return channel
+
+    # storing the V channel computed for key in every cache
+    def store(self, key, channel):
+        self.memory_cache.put(key, channel)
+        if self.disk_cache is not None:
+            self.disk_cache.put(key, channel)
+
+    # returning the V channel after the first count steps (all steps if count is None), read only
+    def channel(self, count=None):
+
+        keys = self.keys()
+        if count is None:
+            count = len(self.steps)
+
+        # closest earlier step which is cached, the original is always known
+        start = count
+        channel = None
+        while start > 0:
+            channel = self.cached(keys[start])
+            if channel is not None:
+                break
+            start -= 1
+        if channel is None:
+            channel = self.image[:, :, 2]
+
+        for i in range(start, count):
+            operation, args = self.steps[i]
+            channel = np.uint8(getattr(self.img_object, operation)(channel, *args))
+            self.store(keys[i + 1], channel)
+
+        self.computed = count - start
+        return channel
+
+    # returning the HSV image after the first count steps (all steps if count is None)
+    def result(self, count=None):
+        channel = self.channel(count)
+
+        image = self.image.copy()
+        image[:, :, 2] = channel
+        return image
+
+    # writing the image after all steps to path in BGR format
+    def export(self, path):
+        if not cv2.imwrite(path, cv2.cvtColor(self.result(), cv2.COLOR_HSV2BGR)):
+            raise IOError("could not write image '%s'" % path)
+
+    # writing the project file, the image path is stored relative to the project file when it is below it
+    # the file is written under a temporary name and renamed so that an interrupted save keeps the old project
+    def save(self, project_path):
+
+        directory = os.path.dirname(os.path.abspath(project_path))
+        image_path = os.path.relpath(self.image_path, directory)
+        if image_path.startswith(os.pardir):
+            image_path = self.image_path
+
+        project = {
+            'version': self.version,
+            'image': image_path,
+            'image_key': self.keys()[0],
+            'steps': [{'operation': operation, 'args': list(args)} for operation, args in self.steps],
+        }
+
+        descriptor, partial_path = tempfile.mkstemp(suffix='.partial', dir=directory)
+        with os.fdopen(descriptor, 'w') as project_file:
+            json.dump(project, project_file, indent=1)
+        os.replace(partial_path, project_path)
+
+
+# reading the project file at project_path and returning its session
+def open_project(project_path, disk_cache=None, img_object=None):
+
+    with open(project_path) as project_file:
+        project = json.load(project_file)
+
+    if project.get('version') != Session.version:
+        raise ValueError("unsupported project version %s in '%s'" % (project.get('version'), project_path))
+
+    image_path = os.path.join(os.path.dirname(os.path.abspath(project_path)), project['image'])
+    steps = [(step['operation'], tuple(step['args'])) for step in project['steps']]
+
+    return Session(image_path, steps, disk_cache, img_object)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render the image of an editor project file.')
+    parser.add_argument('project', help='project file saved by the editor')
+    parser.add_argument('output', help='output image')
+    parser.add_argument('--cache-dir', default=None,
+                        help='directory of cached intermediate results (default: ~/.cache/ee610-image-editor)')
+    parser.add_argument('--cache-size', type=float, default=1024,
+                        help='size limit of the cache directory in MB (default: 1024)')
+    parser.add_argument('--no-cache', action='store_true', help='compute every step without the disk cache')
+    args = parser.parse_args(argv)
+
+    disk_cache = None
+    if not args.no_cache:
+        disk_cache = DiskCache(args.cache_dir, int(args.cache_size * 1024 * 1024))
+
+    session = open_project(args.project, disk_cache)
+    session.export(args.output)
+
+    sys.stderr.write('%d of %d steps computed, earlier steps taken from the cache\n' % (
+        session.computed, len(session.steps)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+from multiprocessing import resource_tracker, shared_memory  # used for passing images between processes
+
+import numpy as np  # used for handling array operations
+
+
+# creating a shared memory block for an array of shape and dtype, returns (block, array using the block)
+# the creating process closes and unlinks the block once no process needs it any more
+def create(shape, dtype=np.uint8):
+    nbytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)  # blocks cannot be empty
+    memory = shared_memory.SharedMemory(create=True, size=nbytes)
+    return memory, np.ndarray(shape, dtype, memory.buf)
+
+
+# attaching to the shared memory block with the name passed, created by another process
+# before python 3.13 attaching registers the block with the resource tracker as if this process owned it, and the
+# tracker would unlink it when this process exits while its owner still uses it, so registering is skipped
+def attach(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name)
+        finally:
+            resource_tracker.register = register
+
+
+# returning the array of shape and dtype stored in the shared memory block passed
+def view(memory, shape, dtype=np.uint8):
+    if int(np.prod(shape)) * np.dtype(dtype).itemsize > memory.size:
+        raise ValueError('shared memory block %s is smaller than an array of shape %s' % (memory.name, shape))
+    return np.ndarray(shape, dtype, memory.buf)
@@ -0,0 +1,72 @@
+# command line report of the import time of the application and of the headless entry points
+# example:
+#   python startup.py              report main and the headless modules
+#   python startup.py main -n 30   30 slowest imports of main
+# each module is imported in a fresh interpreter with -X importtime, modules of the GUI toolkit and of
+# matplotlib pulled in by a headless entry point are reported as errors (exit code 1)
+
+import argparse  # used for parsing command line arguments
+import subprocess  # used for importing modules in a fresh interpreter
+import sys  # used for exit codes and reporting
+
+# modules which must not import Qt/matplotlib
+HEADLESS_MODULES = ('batch', 'video', 'benchmark', 'streaming', 'pipeline', 'session', 'service', 'writer',
+                    'image_processing')
+
+GUI_PACKAGES = ('PyQt5', 'matplotlib')  # packages only the GUI may import
+
+
+# importing module in a fresh interpreter and returning a list of (cumulative microseconds, self microseconds,
+# module name, nesting level) for every module imported, as reported by -X importtime
+def import_times(module):
+
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError('importing %s failed:\n%s' % (module, process.stderr.strip().splitlines()[-1]))
+
+    times = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative), int(own), name.strip(), (len(name) - len(name.lstrip()) - 1) // 2))
+
+    return times
+
+
+# writing the total import time of module, its slowest imports and GUI packages it should not import
+# returns False if module is headless and imports a GUI package
+def report(module, count, stream=sys.stdout):
+
+    times = import_times(module)
+    total = max(cumulative for cumulative, _, _, _ in times)
+
+    stream.write('%s: %.1f ms\n' % (module, total / 1e3))
+    for cumulative, own, name, level in sorted(times, reverse=True)[:count]:
+        stream.write('  %9.1f ms %9.1f ms self  %s%s\n' % (cumulative / 1e3, own / 1e3, '  ' * level, name))
+
+    gui = sorted(set(name.split('.')[0] for _, _, name, _ in times if name.split('.')[0] in GUI_PACKAGES))
+    if gui and module in HEADLESS_MODULES:
+        stream.write('  error: headless module %s imports %s\n' % (module, ', '.join(gui)))
+        return False
+
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report import time of the editor modules.')
+    parser.add_argument('modules', nargs='*', default=('main',) + HEADLESS_MODULES,
+                        help='modules to import (default: main and the headless entry points)')
+    parser.add_argument('-n', '--count', type=int, default=10, help='no. of slowest imports listed per module')
+    args = parser.parse_args(argv)
+
+    ok = True
+    for module in args.modules:
+        ok = report(module, args.count) and ok
+
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import os  # used for handling file paths
+
+import cv2  # used for reading/writing images and colorspace conversion
+import numpy as np  # used for handling array operations
+
+from image_processing import ImageProcessing  # used for the image processing operations
+from pipeline import Pipeline  # used for computing chained operations in a single pass
+
+
+# class running ImageProcessing operations on images kept on disk as numpy.memmap (.npy) files,
+# only a strip of tile_rows rows (plus halo rows) of the image is held in memory at a time
+# so peak memory depends on the strip size and not on the image size, as long as the input and output are .npy
+# arrays (other formats are decoded/encoded whole by cv2)
+# chained operations are fused by Pipeline so that each pass reads and writes the files once for several operations
+class StreamingProcessor(object):
+
+    tile_rows = 1024  # no. of rows of pixels processed at a time
+
+    def __init__(self, img_object=None, tile_rows=None):
+        self.img_object = img_object or ImageProcessing()  # object of ImageProcessing used on the strips
+        if tile_rows:
+            self.tile_rows = tile_rows
+
+    # creating a new memory mapped uint8 image of the given shape at the .npy path passed
+    def create_mapped(self, path, shape):
+        return np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape)
+
+    # opening an existing memory mapped image at the .npy path passed
+    def open_mapped(self, path, mode='r'):
+        return np.load(path, mmap_mode=mode)
+
+    # computing (start, stop) row ranges of the strips for an image with image_row rows
+    def tiles(self, image_row):
+        return [(start, min(start + self.tile_rows, image_row)) for start in range(0, image_row, self.tile_rows)]
+
+    # converting the BGR image at image_path to a memory mapped HSV image at mapped_path
+    # .npy inputs are read strip by strip, other formats have to be decoded whole by cv2 first
+    def import_image(self, image_path, mapped_path):
+
+        if image_path.endswith('.npy'):
+            source = self.open_mapped(image_path)
+        else:
+            source = cv2.imread(image_path, 1)
+            if source is None:
+                raise IOError("could not read image '%s'" % image_path)
+
+        destination = self.create_mapped(mapped_path, source.shape)
+
+        for start, stop in self.tiles(source.shape[0]):
+            destination[start:stop] = cv2.cvtColor(np.ascontiguousarray(source[start:stop]), cv2.COLOR_BGR2HSV)
+
+        destination.flush()
+        return destination  # return the memory mapped HSV image
+
+    # writing the memory mapped HSV image to output_path in BGR format
+    # .npy outputs are written strip by strip, other formats have to be encoded whole by cv2
+    def export_image(self, source, output_path):
+
+        if output_path.endswith('.npy'):
+            destination = self.create_mapped(output_path, source.shape)
+            for start, stop in self.tiles(source.shape[0]):
+                destination[start:stop] = cv2.cvtColor(np.ascontiguousarray(source[start:stop]), cv2.COLOR_HSV2BGR)
+            destination.flush()
+        elif not cv2.imwrite(output_path, cv2.cvtColor(np.asarray(source), cv2.COLOR_HSV2BGR)):
+            raise IOError("could not write image '%s'" % output_path)
+
+    # counting no. of pixels of each value in the V channel, accumulated strip by strip
+    def channel_histogram(self, source):
+
+        histogram = np.zeros(256, dtype=np.int64)
+
+        for start, stop in self.tiles(source.shape[0]):
+            histogram += np.bincount(source[start:stop, :, 2].ravel(), minlength=256)
+
+        return histogram  # return the histogram
+
+    # running the operation (name of an ImageProcessing method) with args on the V channel of the memory mapped
+    # HSV image source and writing the result to destination, destination must not be the same file as source
+    def run(self, operation, source, destination, *args):
+        self.run_stage(Pipeline([(operation, args)], self.img_object), [(operation, args)], source, destination)
+
+    # computing a stage (list of (operation, args) computed in one pass) of pipeline on the V channel of source
+    # and writing the result to destination
+    def run_stage(self, pipeline, stage, source, destination):
+
+        image_row = source.shape[0]  # no. of rows of pixels in the image
+
+        operation, args = stage[0]
+        if operation in pipeline.global_operations:
+            if operation != 'adaptive_histogram_equalization':
+                raise ValueError("'%s' needs the whole image and cannot be computed strip by strip" % operation)
+            self.adaptive_equalization(source, destination, *args)
+            return
+
+        # histogram equalization needs two passes, first accumulating the histogram of the whole image
+        # and then applying the lookup derived from it
+        histogram = self.channel_histogram(source) if pipeline.needs_histogram(stage) else None
+        filters, lut = pipeline.fuse(stage, histogram)
+
+        halo = pipeline.halo(filters)  # no. of neighbouring rows needed on each side
+
+        for start, stop in self.tiles(image_row):
+            low = max(start - halo, 0)  # first row of the strip including halo
+            high = min(stop + halo, image_row)  # one past last row of the strip including halo
+
+            strip = np.ascontiguousarray(source[low:high, :, 2])  # reading V channel of the strip
+            output = pipeline.stage_frame(strip, filters, lut)[start - low:stop - low]  # dropping the halo rows
+
+            destination[start:stop, :, :2] = source[start:stop, :, :2]  # H and S channels are not changed
+            destination[start:stop, :, 2] = output
+
+        destination.flush()
+
+    # computing adaptive histogram equalization (CLAHE) of the V channel of source in two passes, first accumulating
+    # the histograms of the tiles strip by strip and then interpolating the rows of each strip between the lookups
+    # of the tiles, gives the same result as ImageProcessing.adaptive_histogram_equalization on the whole channel
+    def adaptive_equalization(self, source, destination, clip_limit=2.0, tiles=(8, 8)):
+
+        img_object = self.img_object
+        image_row = source.shape[0]  # no. of rows of pixels in the image
+        tile_row, tile_column, row_tiles, column_tiles = img_object.tile_layout(image_row, source.shape[1], tiles)
+
+        histograms = 0
+        for start, stop in self.tiles(image_row):
+            strip = np.ascontiguousarray(source[start:stop, :, 2])
+            histograms = histograms + img_object.tile_histograms(strip, row_tiles[start:stop], column_tiles,
+                                                                 tile_row, tile_column)
+
+        luts = img_object.clipped_luts(histograms, clip_limit)
+        rows = img_object.interpolation_weights(row_tiles, tile_row)
+        columns = img_object.interpolation_weights(column_tiles, tile_column)
+
+        for start, stop in self.tiles(image_row):
+            strip = np.ascontiguousarray(source[start:stop, :, 2])
+            strip_rows = tuple(part[start:stop] for part in rows)  # weights of the rows of the strip only
+
+            destination[start:stop, :, :2] = source[start:stop, :, :2]  # H and S channels are not changed
+            destination[start:stop, :, 2] = img_object.adaptive_equalization_rows(0, stop - start, strip, luts,
+                                                                                  strip_rows, columns, tile_column)
+
+        destination.flush()
+
+    # running a list of (operation, args) on the image at image_path and writing the result to output_path
+    # intermediate images of the passes are memory mapped in work_dir, alternating between two files
+    def process_file(self, image_path, output_path, operations, work_dir):
+
+        paths = [os.path.join(work_dir, name) for name in ('stream_a.npy', 'stream_b.npy', 'stream_c.npy')]
+
+        source = destination = None
+        try:
+            source = self.import_image(image_path, paths[0])
+
+            pipeline = Pipeline(operations, self.img_object)
+
+            for i, stage in enumerate(pipeline.stages()):
+                destination = self.create_mapped(paths[1 + i % 2], source.shape)
+                self.run_stage(pipeline, stage, source, destination)
+                source = destination
+
+            self.export_image(source, output_path)
+
+            return source.shape  # return shape of the processed image
+        finally:
+            # releasing the maps before removing their files, also when a pass failed
+            del source, destination
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
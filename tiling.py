@@ -0,0 +1,256 @@
+import multiprocessing  # used for choosing how worker processes are started
+import multiprocessing.util  # used for stopping worker processes on exit
+import os  # used for finding no. of cpu cores
+import threading  # used for keeping the progress monitor separate for each calling thread
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor  # used for running strips in parallel
+
+import numpy as np  # used for handling array operations
+
+import shared  # used for passing images to worker processes in shared memory
+
+BACKENDS = ('inline', 'thread', 'process')  # ways of running the strips of an image, see make_scheduler
+
+worker_objects = {}  # class => object of the class whose methods a worker process runs on strips
+
+
+# class splitting images into horizontal strips and running neighbourhood filters on them in a thread pool
+# numpy releases the GIL inside its loops, so strips of the same image are processed in parallel
+class TileScheduler(object):
+
+    min_rows = 64  # smallest strip height, smaller strips spend more time on the halo than on the strip
+
+    strips_per_worker = 2  # more strips than workers keeps all workers busy when strips take unequal time
+
+    # storing the monitor of the calling thread, a function called as monitor(done, total) after each strip
+    # is finished, it can raise an exception to stop the remaining strips (e.g. when a job is cancelled)
+    monitors = threading.local()
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1  # no. of threads used, defaults to no. of cpu cores
+        self.executor = None  # thread pool is started on first use and reused afterwards
+
+    # changing the no. of threads used, the running pool is replaced on next use
+    def set_workers(self, workers):
+        self.workers = workers or os.cpu_count() or 1
+        self.shutdown()
+
+    # stopping the threads of the pool
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    # setting the progress monitor for runs started from the calling thread, None removes it
+    def set_monitor(self, monitor):
+        self.monitors.monitor = monitor
+
+    # computing (start, stop) row ranges of the strips for an image with image_row rows
+    def strips(self, image_row):
+
+        count = min(self.workers * self.strips_per_worker, max(1, image_row // self.min_rows))
+        bounds = np.linspace(0, image_row, count + 1).astype(int)
+
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    # running function on every strip of the image (last two axes are rows and columns) and stitching the results
+    # each strip is passed with halo extra rows above and below so that the function sees the same neighbourhood
+    # as for the whole image, rows beyond the image border are not added so zero padding stays the same
+    def run(self, function, image, halo, *args):
+
+        image_row = image.shape[-2]  # no. of rows of pixels in the image
+
+        # computing the function on the strip with halo and dropping the halo rows from the result
+        def run_strip(start, stop):
+            low = max(start - halo, 0)  # first row of the strip including halo
+            high = min(stop + halo, image_row)  # one past last row of the strip including halo
+            return function(image[..., low:high, :], *args)[..., start - low:stop - low, :]
+
+        return self.run_rows(run_strip, image_row)
+
+    # running function(start, stop, *args) for the row range of every strip of an image with image_row rows
+    # and stitching the returned rows, used directly when the function reads shared data (e.g. an integral image)
+    def run_rows(self, function, image_row, *args):
+
+        strips = self.strips(image_row)
+        monitor = getattr(self.monitors, 'monitor', None)
+
+        # single strip is computed directly in the calling thread
+        if len(strips) == 1:
+            if monitor is not None:
+                monitor(0, 1)
+            return function(0, image_row, *args)
+
+        # single worker computes the strips one after the other in the calling thread
+        if self.workers == 1:
+            submit = lambda start, stop: SynchronousResult(function, (start, stop) + args)
+        else:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            submit = lambda start, stop: self.executor.submit(function, start, stop, *args)
+
+        futures = [(submit(start, stop), start, stop) for start, stop in strips]
+
+        # stitching the strips in order
+        output = None
+        try:
+            for done, (future, start, stop) in enumerate(futures):
+                result = future.result()
+                if output is None:
+                    output = np.empty(result.shape[:-2] + (image_row, result.shape[-1]), dtype=result.dtype)
+                output[..., start:stop, :] = result
+
+                if monitor is not None:
+                    monitor(done + 1, len(futures))
+        except BaseException:
+            # strips not yet started are dropped when a strip fails or the monitor stops the run
+            for future, _, _ in futures:
+                future.cancel()
+            raise
+
+        return output  # return the stitched image
+
+
+# result of a strip computed only when it is asked for, used in place of a future when there is a single worker
+class SynchronousResult(object):
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+
+    def result(self):
+        return self.function(*self.args)
+
+    def cancel(self):
+        return True
+
+
+# class running neighbourhood filters on strips of the image in a pool of worker processes
+# the image and the output are placed in shared memory blocks and the workers get the names of the blocks and
+# the rows of their strip only, so no pixel data is pickled. Python code of the filters (e.g. the loops of the
+# correlation) runs in parallel as well, which threads cannot do. The pool is started on first use and its
+# workers stay warm for later runs
+# run_rows functions read shared data computed by the caller (e.g. an integral image) and still run on threads
+class ProcessTileScheduler(TileScheduler):
+
+    def __init__(self, workers=None):
+        TileScheduler.__init__(self, workers)
+        self.process_executor = None  # process pool, started on first use
+
+    def shutdown(self):
+        TileScheduler.shutdown(self)
+        if getattr(self, 'process_executor', None) is not None:
+            self.process_executor.shutdown(wait=True)
+            self.process_executor = None
+
+    # starting the worker processes, forked from a fork server as the calling process may run threads (e.g. Qt)
+    def start_processes(self):
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        if 'forkserver' in methods:
+            context.set_forkserver_preload(['image_processing', 'pipeline'])  # workers start with them imported
+        self.process_executor = ProcessPoolExecutor(self.workers, mp_context=context)
+
+        # stopping the workers when this process exits, also when it is itself a worker process (e.g. of batch.py)
+        # which exits without running atexit handlers. The priority runs it before the queues of the pool are
+        # closed by their own exit handlers, the workers could not be told to stop afterwards
+        multiprocessing.util.Finalize(self, self.shutdown, exitpriority=100)
+
+    # running function (a method of an object whose class can be created without arguments, e.g.
+    # ImageProcessing.blur_frame) on every strip of the image with halo rows, as TileScheduler.run
+    def run(self, function, image, halo, *args):
+
+        image_row = image.shape[-2]  # no. of rows of pixels in the image
+        strips = self.strips(image_row)
+        owner = getattr(function, '__self__', None)
+
+        # single strip, or functions which are not methods, are computed as by the threaded scheduler
+        if len(strips) == 1 or owner is None or self.workers == 1:
+            return TileScheduler.run(self, function, image, halo, *args)
+
+        # type and no. of columns of the output found from a strip of a few rows
+        probe = function(image[..., :min(image_row, 2 * halo + 1), :], *args)
+        output_shape = image.shape[:-2] + (image_row, probe.shape[-1])
+
+        if self.process_executor is None:
+            self.start_processes()
+
+        monitor = getattr(self.monitors, 'monitor', None)
+        method = (type(owner), function.__name__)
+
+        source_block, source = shared.create(image.shape, image.dtype)
+        output_block, output = shared.create(output_shape, probe.dtype)
+        try:
+            source[...] = image
+            source_spec = (source_block.name, image.shape, image.dtype.str)
+            output_spec = (output_block.name, output_shape, probe.dtype.str)
+
+            futures = [self.process_executor.submit(run_tile, method, args, source_spec, output_spec, start, stop,
+                                                    halo) for start, stop in strips]
+            try:
+                for done, future in enumerate(futures):
+                    future.result()
+                    if monitor is not None:
+                        monitor(done + 1, len(futures))
+            except BaseException:
+                # strips not yet started are dropped when a strip fails or the monitor stops the run
+                for future in futures:
+                    future.cancel()
+                raise
+
+            result = output.copy()
+        finally:
+            del source, output  # views of the blocks have to be released before closing them
+            for block in (source_block, output_block):
+                block.close()
+                block.unlink()
+
+        return result  # return the stitched image
+
+
+# computing rows start to stop of the output of method (class, name) with args in a worker process
+# source and output are (shared memory block name, shape, dtype) of the image and of the output
+def run_tile(method, args, source, output, start, stop, halo):
+
+    owner_class, name = method
+    if owner_class not in worker_objects:
+        worker_objects[owner_class] = owner_class()
+
+    source_block = shared.attach(source[0])
+    output_block = shared.attach(output[0])
+    try:
+        compute_tile(getattr(worker_objects[owner_class], name), args, source_block, source, output_block, output,
+                     start, stop, halo)
+    finally:
+        source_block.close()
+        output_block.close()
+
+
+# computing the strip with the views of the blocks local to this function, so they are released on return
+def compute_tile(function, args, source_block, source, output_block, output, start, stop, halo):
+
+    image = shared.view(source_block, source[1], np.dtype(source[2]))
+    image_row = image.shape[-2]
+
+    low = max(start - halo, 0)  # first row of the strip including halo
+    high = min(stop + halo, image_row)  # one past last row of the strip including halo
+
+    result = function(image[..., low:high, :], *args)[..., start - low:stop - low, :]
+    shared.view(output_block, output[1], np.dtype(output[2]))[..., start:stop, :] = result
+
+
+# returning the scheduler of the backend passed
+#   'inline'   whole image computed in the calling thread
+#   'thread'   strips computed by a thread pool, numpy loops run in parallel as they release the GIL
+#   'process'  strips computed by a pool of worker processes through shared memory
+def make_scheduler(backend='thread', workers=None):
+
+    if backend == 'inline':
+        scheduler = TileScheduler(1)
+        scheduler.strips_per_worker = 1  # a single strip covering the whole image
+        return scheduler
+    if backend == 'thread':
+        return TileScheduler(workers)
+    if backend == 'process':
+        return ProcessTileScheduler(workers)
+
+    raise ValueError("unknown backend '%s', expected one of %s" % (backend, ', '.join(BACKENDS)))
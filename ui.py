@@ -57,23 +57,23 @@ class Ui_Dialog(object):
         self.line_7.setObjectName(_fromUtf8("line_7"))
         self.verticalLayout.addWidget(self.line_7)
 
-        # define image display area
-        self.imageDisplayLabel = QtWidgets.QLabel(self.centralwidget)
-        self.imageDisplayLabel.setAlignment(QtCore.Qt.AlignHCenter
-                                            |QtCore.Qt.AlignVCenter)
+        # define image display area, zoomed with the mouse wheel and panned by dragging
+        self.imageView = PyramidView(self.centralwidget)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.MinimumExpanding,
                                        QtWidgets.QSizePolicy.MinimumExpanding)
         sizePolicy.setHorizontalStretch(0)
         sizePolicy.setVerticalStretch(0)
-        sizePolicy.setHeightForWidth(self.imageDisplayLabel.sizePolicy().
+        sizePolicy.setHeightForWidth(self.imageView.sizePolicy().
                                      hasHeightForWidth())
-        self.imageDisplayLabel.setSizePolicy(sizePolicy)
-        self.imageDisplayLabel.setAutoFillBackground(False)
-        self.imageDisplayLabel.setStyleSheet(_fromUtf8("background-color: "
-                                                       "rgb(255, 255, 255);"))
-        self.imageDisplayLabel.setText(_fromUtf8(""))
-        self.imageDisplayLabel.setObjectName(_fromUtf8("imageDisplayLabel"))
-        self.verticalLayout.addWidget(self.imageDisplayLabel)
+        self.imageView.setSizePolicy(sizePolicy)
+        self.imageView.setObjectName(_fromUtf8("imageView"))
+        self.verticalLayout.addWidget(self.imageView)
+
+        # define histogram of the V channel shown below the image, updated while editing
+        self.histogramView = HistogramView(self.centralwidget)
+        self.histogramView.setMaximumHeight(120)
+        self.histogramView.setObjectName(_fromUtf8("histogramView"))
+        self.verticalLayout.addWidget(self.histogramView)
 
         self.gridLayout_2.addLayout(self.verticalLayout, 1, 3, 2, 1)
         self.verticalLayout_3 = QtWidgets.QVBoxLayout()
@@ -114,6 +114,12 @@ class Ui_Dialog(object):
             _fromUtf8("histogramEqualizationButton"))
         self.verticalLayout_3.addWidget(self.histogramEqualizationButton)
 
+        # define Adaptive Equalization button
+        self.adaptiveEqualizationButton = QtWidgets.QPushButton(self.centralwidget)
+        self.adaptiveEqualizationButton.setEnabled(False)
+        self.adaptiveEqualizationButton.setObjectName(_fromUtf8("adaptiveEqualizationButton"))
+        self.verticalLayout_3.addWidget(self.adaptiveEqualizationButton)
+
         # define View Histogram button
         self.viewHistogramButton = QtWidgets.QPushButton(self.centralwidget)
         self.viewHistogramButton.setObjectName(_fromUtf8("viewHistogramButton"))
@@ -231,6 +237,12 @@ class Ui_Dialog(object):
         self.undoButton.setEnabled(False)
         self.horizontalLayout_4.addWidget(self.undoButton)
 
+        # define Redo button
+        self.redoButton = QtWidgets.QPushButton(self.centralwidget)
+        self.redoButton.setObjectName(_fromUtf8("redoButton"))
+        self.redoButton.setEnabled(False)
+        self.horizontalLayout_4.addWidget(self.redoButton)
+
         # define Undo All button
         self.undo_allButton = QtWidgets.QPushButton(self.centralwidget)
         self.undo_allButton.setObjectName(_fromUtf8("undo_allButton"))
@@ -297,6 +309,8 @@ class Ui_Dialog(object):
                                      ("MainWindow", "Save", None))
         self.histogramEqualizationButton.setText(_translate
                                                  ("MainWindow", "Histogram Equalization", None))
+        self.adaptiveEqualizationButton.setText(_translate
+                                                ("MainWindow", "Adaptive Equalization", None))
         self.gammaCorrectionButton.setText(_translate
                                            ("MainWindow", "Gamma Correction", None))
         self.logTransformButton.setText(_translate
@@ -312,6 +326,8 @@ class Ui_Dialog(object):
                                        ("MainWindow", "0", None))
         self.undoButton.setText(_translate
                                 ("MainWindow", "Undo", None))
+        self.redoButton.setText(_translate
+                                ("MainWindow", "Redo", None))
         self.undo_allButton.setText(_translate
                                    ("MainWindow", "Undo All", None))
         self.detectEdgeButton.setText(_translate
@@ -403,3 +419,5 @@ class InputDialogGuiClass(QtWidgets.QDialog):
                                         "NB: Enter a value between 0 and 10", None))
         self.cancelButton.setText(_translate("InputDialog", "Cancel", None))
         self.okButton.setText(_translate("InputDialog", "OK", None))
+
+from viewer import PyramidView, HistogramView
@@ -0,0 +1,321 @@
+# command line entry point running ImageProcessing operations on the V channel of every frame of a video file
+# or an image sequence, frames are streamed through a pipeline so the clip is never loaded whole
+# example:
+#   python video.py clip.mp4 clip_equalized.mp4 --recipe equalize,blur=1 --smoothing 0.9
+#   python video.py "frames/*.png" "out/*.png" --recipe edges
+
+import argparse  # used for parsing command line arguments
+import glob  # used for expanding image sequence patterns
+import os  # used for handling file paths
+import queue  # used for the bounded queues between pipeline stages
+import sys  # used for exit codes and reporting
+import threading  # used for running the pipeline stages
+import time  # used for measuring throughput
+
+import cv2  # used for reading/writing frames and colorspace conversion
+import numpy as np  # used for handling array operations
+
+from batch import parse_recipe  # used for parsing the operation recipe
+from image_processing import ImageProcessing  # used for the image processing operations
+from pipeline import Pipeline  # used for computing chained operations in a single pass
+
+
+# class reading BGR frames from a video file, or from the image files matching a glob pattern in name order
+class FrameSource(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.paths = None  # image files of an image sequence, None for a video file
+        self.capture = None
+
+        if glob.has_magic(path):
+            self.paths = sorted(glob.glob(path))
+            if not self.paths:
+                raise IOError("no images match '%s'" % path)
+        else:
+            self.capture = cv2.VideoCapture(path)
+            if not self.capture.isOpened():
+                raise IOError("could not open video '%s'" % path)
+
+    # frame rate of the video, None for image sequences
+    def fps(self):
+        if self.capture is None:
+            return None
+        return self.capture.get(cv2.CAP_PROP_FPS) or None
+
+    # yielding the frames one by one
+    def frames(self):
+        if self.paths is not None:
+            for path in self.paths:
+                frame = cv2.imread(path, 1)
+                if frame is None:
+                    raise IOError("could not read image '%s'" % path)
+                yield frame
+        else:
+            while True:
+                ok, frame = self.capture.read()
+                if not ok:
+                    break
+                yield frame
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+
+
+# class writing BGR frames to a video file, or to numbered image files
+# output is a video file (by extension), a pattern where * is replaced by the frame no. or a directory
+class FrameSink(object):
+
+    video_codecs = {'.mp4': 'mp4v', '.m4v': 'mp4v', '.mov': 'mp4v', '.avi': 'MJPG', '.mkv': 'MJPG'}
+
+    default_fps = 25.0  # frame rate of videos written from image sequences
+
+    def __init__(self, path, fps=None):
+        self.path = path
+        self.fps = fps or self.default_fps
+        self.writer = None  # video writer, opened when the size of the first frame is known
+        self.count = 0  # no. of frames written
+
+        self.codec = self.video_codecs.get(os.path.splitext(path)[1].lower())
+
+        if self.codec is None:
+            if '*' not in path:
+                self.path = os.path.join(path, 'frame_*.png')
+            directory = os.path.dirname(self.path)
+        else:
+            directory = os.path.dirname(path)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, frame):
+        if self.codec is not None:
+            if self.writer is None:
+                self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.codec), self.fps,
+                                              (frame.shape[1], frame.shape[0]))
+                if not self.writer.isOpened():
+                    raise IOError("could not open video '%s' for writing" % self.path)
+            self.writer.write(frame)
+        else:
+            path = self.path.replace('*', '%06d' % self.count)
+            if not cv2.imwrite(path, frame):
+                raise IOError("could not write image '%s'" % path)
+
+        self.count += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+# class processing frames with a pipeline of threads connected by bounded queues
+#   decoder => work queue => workers => done queue => encoder
+# the decoder reads frames, converts them to HSV and fixes the lookup of smoothed histogram equalization steps,
+# workers run the operations on the V channel in parallel, and the encoder puts frames back in order before
+# writing them. A frame slot is taken for each decoded frame and given back once it is written, so at most
+# max_in_flight frames are held at a time whatever the speed of each stage
+class VideoProcessor(object):
+
+    queue_size = 8  # no. of frames each queue holds before the stage feeding it waits
+
+    # operations computed with a lookup, the histogram after them is known from the histogram before them
+    point_operations = ('histogram_equalization', 'gamma_correction', 'log_transform')
+
+    def __init__(self, operations, workers=None, smoothing=0.0, queue_size=None, img_object=None):
+        self.operations = operations  # list of (operation, args) run on the V channel of each frame
+        self.workers = workers or os.cpu_count() or 1  # no. of processing threads
+        self.smoothing = smoothing  # weight of earlier frames in the histogram of equalization, 0 for none
+        if queue_size:
+            self.queue_size = queue_size
+
+        # frames are processed in parallel by the workers so each operation uses a single thread
+        self.img_object = img_object or ImageProcessing(1)
+
+        self.max_in_flight = 2 * self.queue_size + self.workers  # frames decoded and not yet written
+        self.errors = []  # exceptions raised in any stage
+        self.stop = threading.Event()  # set when a stage fails so that the others stop waiting
+
+        self.frames = 0  # no. of frames written
+
+    # putting item in the queue, waiting while it is full unless the pipeline is stopped
+    def put(self, items, item):
+        while not self.stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    # taking the next item from the queue, None once the pipeline is stopped
+    def get(self, items):
+        while not self.stop.is_set():
+            try:
+                return items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    # running stage with args in the calling thread, an exception stops the whole pipeline
+    def run_stage(self, stage, *args):
+        try:
+            stage(*args)
+        except BaseException as error:
+            self.errors.append(error)
+            self.stop.set()
+
+    # computing the operations of a frame with the V channel passed
+    # equalization steps which are not preceded by a neighbourhood operation are replaced by the lookup of
+    # the histogram smoothed over earlier frames, the histogram after point operations is computed from the
+    # histogram before them so the V channel is read only once. smoothed holds the histogram of each step
+    def frame_operations(self, channel, smoothed):
+
+        if not self.smoothing:
+            return self.operations
+
+        histogram = self.img_object.histograms(channel).astype(np.float64)
+        operations = []
+
+        for i, (operation, args) in enumerate(self.operations):
+            if histogram is None or operation not in self.point_operations:
+                histogram = None  # histogram after a neighbourhood operation is not known before computing it
+                operations.append((operation, args))
+                continue
+
+            if operation == 'histogram_equalization':
+                pmf = histogram / histogram.sum()
+                smoothed[i] = pmf if i not in smoothed else self.smoothing * smoothed[i] + (1 - self.smoothing) * pmf
+                lut = self.img_object.equalization_lut(smoothed[i])
+                operations.append(('apply_lut', (lut,)))
+            else:
+                lut = self.img_object.point_lut(operation, channel, *args)
+                operations.append((operation, args))
+
+            histogram = np.bincount(lut, weights=histogram, minlength=256)  # histogram after the lookup
+
+        return operations
+
+    # decoder stage reading frames of source into the work queue
+    def decode(self, source, work, slots):
+        smoothed = {}  # step index => smoothed histogram of equalization steps
+
+        try:
+            for index, frame in enumerate(source.frames()):
+                # waiting for a free frame slot, given back by the encoder
+                while not slots.acquire(timeout=0.1):
+                    if self.stop.is_set():
+                        return
+                if self.stop.is_set():
+                    return
+
+                image = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+                operations = self.frame_operations(image[:, :, 2], smoothed)
+
+                if not self.put(work, (index, image, operations)):
+                    return
+        finally:
+            for _ in range(self.workers):
+                self.put(work, None)  # one end marker for each worker
+
+    # worker stage running the operations of frames from the work queue into the done queue
+    def process(self, work, done):
+        try:
+            while True:
+                item = self.get(work)
+                if item is None:
+                    return
+                index, image, operations = item
+
+                image[:, :, 2] = Pipeline(operations, self.img_object).run(image[:, :, 2])
+
+                if not self.put(done, (index, cv2.cvtColor(image, cv2.COLOR_HSV2BGR))):
+                    return
+        finally:
+            self.put(done, None)  # end marker of this worker
+
+    # encoder stage writing frames of the done queue to sink in frame order
+    def encode(self, sink, done, slots):
+        pending = {}  # index => frame finished before the frames ahead of it
+        running = self.workers  # no. of workers which have not ended
+
+        while running:
+            item = self.get(done)
+            if item is None:
+                if self.stop.is_set():
+                    return
+                running -= 1
+                continue
+
+            index, frame = item
+            pending[index] = frame
+
+            while self.frames in pending:
+                sink.write(pending.pop(self.frames))
+                self.frames += 1
+                slots.release()
+
+    # processing all frames of source into sink, returns no. of frames written
+    def run(self, source, sink):
+        work = queue.Queue(self.queue_size)
+        done = queue.Queue(self.queue_size)
+        slots = threading.Semaphore(self.max_in_flight)
+
+        threads = [threading.Thread(target=self.run_stage, args=(self.decode, source, work, slots))]
+        threads += [threading.Thread(target=self.run_stage, args=(self.process, work, done))
+                    for _ in range(self.workers)]
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        self.run_stage(self.encode, sink, done, slots)  # encoder runs in the calling thread
+
+        for thread in threads:
+            thread.join()
+
+        if self.errors:
+            raise self.errors[0]
+
+        return self.frames
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run image editor operations on the V channel of video frames.')
+    parser.add_argument('input', help='video file, or glob pattern of an image sequence e.g. "frames/*.png"')
+    parser.add_argument('output', help='video file (.mp4, .avi, ...), image pattern where * is replaced by the '
+                                       'frame no. e.g. "out/*.png", or a directory')
+    parser.add_argument('-r', '--recipe', required=True,
+                        help='comma separated operations applied in order: equalize, gamma=G, log, blur=N '
+                             '(window 2N+1), sharpen=C, edges, clahe=L (adaptive equalization, clip limit L)')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='no. of processing threads')
+    parser.add_argument('--smoothing', type=float, default=0.0,
+                        help='weight (0 to 1) of earlier frames in the equalization histogram, reduces flicker')
+    parser.add_argument('--fps', type=float, default=None, help='frame rate of the output video')
+    args = parser.parse_args(argv)
+
+    try:
+        operations = parse_recipe(args.recipe)
+    except ValueError as error:
+        parser.error(str(error))
+    if not 0 <= args.smoothing < 1:
+        parser.error('smoothing must be between 0 and 1')
+
+    source = FrameSource(args.input)
+    sink = FrameSink(args.output, args.fps or source.fps())
+
+    start = time.perf_counter()
+    try:
+        frames = VideoProcessor(operations, args.workers, args.smoothing).run(source, sink)
+    finally:
+        source.close()
+        sink.close()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    sys.stderr.write('%d frames in %.1f s (%.1f frames/s)\n' % (frames, elapsed, frames / elapsed))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
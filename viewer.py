@@ -0,0 +1,219 @@
+import math  # used for choosing the pyramid level
+
+# PyQt5 libraries are used for drawing the image and handling mouse events
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+
+# widget showing an ImagePyramid with zoom (mouse wheel), pan (drag) and fit to window (double click)
+# only the tiles of the pyramid level matching the zoom which intersect the viewport are drawn
+class PyramidView(QtWidgets.QWidget):
+
+    zoomChanged = QtCore.pyqtSignal(float)  # emitted with the new zoom when the view is zoomed or panned
+
+    zoom_step = 1.25  # zoom factor of one mouse wheel step
+
+    max_zoom = 16.0  # largest zoom, pixels are shown as 16 x 16 squares
+
+    def __init__(self, parent=None):
+        super(PyramidView, self).__init__(parent)
+
+        self.pyramid = None  # pyramid of the image shown
+        self.zoom = 1.0  # no. of screen pixels per image pixel
+        self.center = QtCore.QPointF(0, 0)  # image point shown at the center of the widget
+        self.fit = True  # zoom follows widget size while the image is fitted to the window
+        self.preview = None  # (RGB array, image rectangle) drawn instead of the pyramid while a preview is shown
+        self.drag_start = None  # mouse position and center when panning started
+
+        self.setMouseTracking(False)
+        self.setAutoFillBackground(False)
+
+    # showing the pyramid passed, zoom is reset to fit the window if fit is True
+    def set_pyramid(self, pyramid, fit=True):
+        self.pyramid = pyramid
+        self.preview = None
+        if fit:
+            self.fit_to_window()
+        self.update()
+
+    # size of the image shown as (height, width)
+    def image_shape(self):
+        return self.pyramid.image.shape[:2]
+
+    # zooming so that the whole image fits in the widget
+    def fit_to_window(self):
+        if self.pyramid is None or self.pyramid.image is None:
+            return
+        height, width = self.image_shape()
+        self.fit = True
+        self.zoom = min(self.width() / width, self.height() / height)
+        self.center = QtCore.QPointF(width / 2.0, height / 2.0)
+        self.zoomChanged.emit(self.zoom)
+
+    # drawing the RGB array over the image rectangle (x0, y0, x1, y1) instead of the pyramid, used for previews
+    def set_preview(self, rgb, rectangle):
+        self.preview = (rgb, rectangle)
+        self.update()
+
+    # removing the preview so that the pyramid is drawn again
+    def clear_preview(self):
+        self.preview = None
+        self.update()
+
+    # converting a point in image coordinates to widget coordinates
+    def to_widget(self, x, y):
+        return QtCore.QPointF((x - self.center.x()) * self.zoom + self.width() / 2.0,
+                              (y - self.center.y()) * self.zoom + self.height() / 2.0)
+
+    # converting a point in widget coordinates to image coordinates
+    def to_image(self, point):
+        return QtCore.QPointF((point.x() - self.width() / 2.0) / self.zoom + self.center.x(),
+                              (point.y() - self.height() / 2.0) / self.zoom + self.center.y())
+
+    # image rectangle (x0, y0, x1, y1) visible in the widget, clipped to the image
+    def visible_region(self):
+        height, width = self.image_shape()
+        top_left = self.to_image(QtCore.QPointF(0, 0))
+        bottom_right = self.to_image(QtCore.QPointF(self.width(), self.height()))
+
+        x0 = min(max(int(math.floor(top_left.x())), 0), width - 1)
+        y0 = min(max(int(math.floor(top_left.y())), 0), height - 1)
+        x1 = max(min(int(math.ceil(bottom_right.x())), width), x0 + 1)
+        y1 = max(min(int(math.ceil(bottom_right.y())), height), y0 + 1)
+
+        return x0, y0, x1, y1
+
+    # pyramid level whose resolution is closest above the zoom
+    def level(self):
+        if self.zoom >= 1.0:
+            return 0
+        return min(int(math.floor(math.log2(1.0 / self.zoom))), self.pyramid.levels() - 1)
+
+    # drawing an RGB array into the target rectangle of the painter
+    def draw_rgb(self, painter, rgb, target):
+        image = QtGui.QImage(rgb.data, rgb.shape[1], rgb.shape[0], rgb.strides[0], QtGui.QImage.Format_RGB888)
+        painter.drawImage(target, image)
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtGui.QColor(255, 255, 255))
+
+        if self.pyramid is None or self.pyramid.image is None:
+            return
+
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, self.zoom < 2.0)
+
+        if self.preview is not None:
+            rgb, (x0, y0, x1, y1) = self.preview
+            self.draw_rgb(painter, rgb, QtCore.QRectF(self.to_widget(x0, y0), self.to_widget(x1, y1)))
+            return
+
+        level = self.level()
+        span = self.pyramid.tile_size * 2 ** level  # no. of image pixels covered by a tile of the level
+        rows, columns = self.pyramid.grid(level)
+        height, width = self.image_shape()
+
+        # drawing only the tiles which intersect the visible region
+        x0, y0, x1, y1 = self.visible_region()
+        for ty in range(y0 // span, min((y1 - 1) // span + 1, rows)):
+            for tx in range(x0 // span, min((x1 - 1) // span + 1, columns)):
+                tile = self.pyramid.tile(level, ty, tx)
+                target = QtCore.QRectF(self.to_widget(tx * span, ty * span),
+                                       self.to_widget(min((tx + 1) * span, width), min((ty + 1) * span, height)))
+                self.draw_rgb(painter, tile, target)
+
+    def resizeEvent(self, event):
+        if self.fit:
+            self.fit_to_window()
+        super(PyramidView, self).resizeEvent(event)
+
+    # zooming in or out keeping the image point under the mouse fixed
+    def wheelEvent(self, event):
+        if self.pyramid is None or self.pyramid.image is None:
+            return
+
+        steps = event.angleDelta().y() / 120.0
+        zoom = min(max(self.zoom * self.zoom_step ** steps, self.fit_zoom() / 4.0), self.max_zoom)
+
+        anchor = self.to_image(event.pos())
+        offset = QtCore.QPointF(event.pos().x() - self.width() / 2.0, event.pos().y() - self.height() / 2.0)
+        self.zoom = zoom
+        self.center = QtCore.QPointF(anchor.x() - offset.x() / zoom, anchor.y() - offset.y() / zoom)
+        self.fit = False
+
+        self.zoomChanged.emit(self.zoom)
+        self.update()
+
+    # zoom which fits the whole image in the widget
+    def fit_zoom(self):
+        height, width = self.image_shape()
+        return min(self.width() / width, self.height() / height)
+
+    def mousePressEvent(self, event):
+        if event.button() == QtCore.Qt.LeftButton:
+            self.drag_start = (event.pos(), QtCore.QPointF(self.center))
+
+    def mouseMoveEvent(self, event):
+        if self.drag_start is not None:
+            position, center = self.drag_start
+            self.center = QtCore.QPointF(center.x() - (event.pos().x() - position.x()) / self.zoom,
+                                         center.y() - (event.pos().y() - position.y()) / self.zoom)
+            self.fit = False
+            self.update()
+
+    def mouseReleaseEvent(self, event):
+        if self.drag_start is not None:
+            self.drag_start = None
+            self.zoomChanged.emit(self.zoom)  # visible region changed
+
+    def mouseDoubleClickEvent(self, event):
+        self.fit_to_window()
+        self.update()
+
+
+# widget drawing a 256 bin histogram as a filled curve, used for the V channel of the image being edited
+class HistogramView(QtWidgets.QWidget):
+
+    def __init__(self, parent=None):
+        super(HistogramView, self).__init__(parent)
+
+        self.histogram = None  # counts of each value 0-255
+        self.exact = True  # counts are exact, approximate counts are marked in the corner
+        self.setMinimumHeight(80)
+
+    # showing the histogram passed, exact is False when the counts were estimated from a sample of the pixels
+    def set_histogram(self, histogram, exact=True):
+        self.histogram = histogram
+        self.exact = exact
+        self.update()
+
+    def clear(self):
+        self.histogram = None
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtGui.QColor(255, 255, 255))
+
+        if self.histogram is None or not self.histogram.any():
+            return
+
+        width = self.width()
+        height = self.height() - 1
+        scale = height / self.histogram.max()  # tallest bin fills the widget
+
+        # closed polygon along the top of the bins, each bin is width / 256 pixels wide
+        polygon = QtGui.QPolygonF()
+        polygon.append(QtCore.QPointF(0, height))
+        for value, count in enumerate(self.histogram):
+            top = height - count * scale
+            polygon.append(QtCore.QPointF(value * width / 256.0, top))
+            polygon.append(QtCore.QPointF((value + 1) * width / 256.0, top))
+        polygon.append(QtCore.QPointF(width, height))
+
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.setBrush(QtGui.QColor(80, 80, 80))
+        painter.drawPolygon(polygon)
+
+        if not self.exact:
+            painter.setPen(QtGui.QColor(128, 128, 128))
+            painter.drawText(self.rect().adjusted(0, 2, -4, 0), QtCore.Qt.AlignRight | QtCore.Qt.AlignTop, 'approx.')
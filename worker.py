@@ -0,0 +1,157 @@
+import traceback  # used for reporting errors of background jobs
+
+# PyQt5 libraries are used for running jobs off the GUI thread and posting results back to it
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+
+
+# raised inside a running job when a newer job has been submitted, stops the remaining strips of the image
+class JobCancelled(Exception):
+    pass
+
+
+# class running a single image processing function on a thread of the job runner pool
+class Job(QRunnable):
+
+    def __init__(self, runner, generation, key, function, args, callback):
+        super(Job, self).__init__()
+        self.setAutoDelete(False)  # job is kept alive by the runner until its result is delivered
+
+        self.runner = runner  # job runner which started the job
+        self.generation = generation  # submission no. of the job, jobs older than the latest are stale
+        self.key = key  # operation code of the job
+        self.function = function  # function computing the result
+        self.args = args  # arguments of the function
+        self.callback = callback  # function called on the GUI thread with the result
+
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.delivered = False
+
+    # called on the pool thread
+    def run(self):
+        scheduler = self.runner.scheduler
+        scheduler.set_monitor(self.check)  # strips of the image report progress and check for cancellation
+
+        try:
+            self.check(0, 1)
+            self.result = self.function(*self.args)
+        except JobCancelled:
+            self.cancelled = True
+        except Exception:
+            self.error = traceback.format_exc()
+        finally:
+            scheduler.set_monitor(None)
+            self.runner.finished.emit(self)  # delivered to the GUI thread through the queued signal
+
+    # reporting progress of the job and stopping it if a newer job was submitted
+    def check(self, done, total):
+        if self.generation != self.runner.generation:
+            raise JobCancelled()
+        self.runner.progress.emit(int(100 * done / total))
+
+    def is_stale(self):
+        return self.cancelled or self.generation != self.runner.generation
+
+
+# class running image processing jobs one at a time on a background thread
+# slider events are debounced (coalesced) by delaying the start of their job, a newer job of the same
+# operation replaces a pending job and cancels a running one, results of stale jobs are dropped
+class JobRunner(QObject):
+
+    finished = pyqtSignal(object)  # emitted from the pool thread with the finished job
+    progress = pyqtSignal(int)  # emitted with percentage of the running job completed
+    busy = pyqtSignal(bool)  # emitted when the runner starts and stops running jobs
+    failed = pyqtSignal(str)  # emitted with the traceback of a failed job
+
+    debounce = 40  # milliseconds slider jobs wait for further slider events before starting
+
+    def __init__(self, scheduler, parent=None):
+        super(JobRunner, self).__init__(parent)
+
+        self.scheduler = scheduler  # tile scheduler of the image processing object, used for monitoring strips
+
+        # single thread so that only one full frame job uses memory and cpu at a time
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+
+        # timer starting the pending job after the debounce delay
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.start_pending)
+
+        self.generation = 0  # no. of the latest submitted job
+        self.pending = None  # job waiting for the timer
+        self.active = []  # jobs started and not yet delivered
+
+        self.finished.connect(self.deliver)
+
+    # submitting function(*args) as a job, callback(result) is called on the GUI thread when it finishes
+    # if supersede is True a pending or running job of the same key is replaced by this job, otherwise
+    # the earlier job is completed first so that jobs see the results of the earlier ones
+    def submit(self, key, function, args, callback, delay=0, supersede=False):
+        if not (supersede and self.latest_key() == key):
+            self.flush()
+
+        self.generation += 1
+        self.pending = Job(self, self.generation, key, function, args, callback)
+        self.timer.start(delay)
+
+    # waiting for jobs of other operations than key to complete, used before reading the current image
+    def flush_other(self, key):
+        if self.latest_key() not in (None, key):
+            self.flush()
+
+    # dropping the pending job and cancelling the running job, their results are not delivered
+    def cancel(self):
+        self.timer.stop()
+        self.pending = None
+        self.generation += 1
+
+    # blocking until the latest job has finished and its callback has been called
+    def flush(self):
+        if self.pending is not None:
+            self.timer.stop()
+            self.start_pending()
+
+        self.pool.waitForDone()
+
+        for job in list(self.active):
+            self.deliver(job)
+
+    # operation code of the latest submitted job that is not yet delivered, None if there is no such job
+    def latest_key(self):
+        if self.pending is not None:
+            return self.pending.key
+        if self.active and not self.active[-1].is_stale():
+            return self.active[-1].key
+        return None
+
+    # starting the pending job on the pool thread
+    def start_pending(self):
+        job, self.pending = self.pending, None
+
+        if job is not None:
+            if not self.active:
+                self.busy.emit(True)
+            self.active.append(job)
+            self.pool.start(job)
+
+    # calling the callback of a finished job on the GUI thread, stale jobs are dropped
+    def deliver(self, job):
+        if job.delivered:
+            return
+        job.delivered = True
+        self.active.remove(job)
+
+        if not self.active and self.pending is None:
+            self.busy.emit(False)
+
+        if job.is_stale():
+            return
+
+        if job.error is not None:
+            self.failed.emit(job.error)
+            return
+
+        job.callback(job.result)
@@ -0,0 +1,162 @@
+# writing images in the background: exports are encoded and written by a writer thread in the order they were
+# submitted, so the editor keeps running while a large image is saved
+# the image of an export is not copied, it must not be changed in place while holds(image) is true, the editor
+# copies its current image before the next edit instead (copy on write)
+
+import os  # used for handling file paths
+import queue  # used for the queue of pending exports
+import threading  # used for the writer thread
+
+import cv2  # used for colorspace conversion and encoding images
+
+# format names whose encoder options are those of another extension, any other format (e.g. png, jp2, ppm, exr)
+# is passed to the encoder as it is and cv2 decides if it can write it
+FORMATS = {
+    'jpeg': '.jpg',
+    'jpe': '.jpg',
+    'tif': '.tiff',
+}
+
+
+# returning the encoder extension of the format passed, or of the extension of path if format is None
+def image_format(path, format=None):
+
+    name = (format or os.path.splitext(path)[1]).lower().lstrip('.')
+    if not name:
+        raise ValueError("no image format given for '%s', add an extension such as .png" % path)
+
+    return FORMATS.get(name, '.' + name)
+
+
+# returning the encoder parameters for extension, options which are None keep the defaults of the encoder
+# quality is used by JPEG and WebP (0-100), compression by PNG (0-9, higher is smaller and slower) and
+# progressive by JPEG
+def encode_parameters(extension, quality=None, compression=None, progressive=False):
+
+    parameters = []
+
+    if extension == '.jpg':
+        if quality is not None:
+            parameters += [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+        if progressive:
+            parameters += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+    elif extension == '.webp':
+        if quality is not None:
+            parameters += [cv2.IMWRITE_WEBP_QUALITY, max(1, int(quality))]  # 0 is not accepted
+    elif extension == '.png':
+        if compression is not None:
+            parameters += [cv2.IMWRITE_PNG_COMPRESSION, int(compression)]
+
+    return parameters
+
+
+# encoding the image (converted first with the cv2 colorspace code conversion if it is passed) and writing it to
+# path, the file is written under a temporary name and renamed so that an interrupted write keeps the old file
+def write_image(path, image, format=None, quality=None, compression=None, progressive=False, conversion=None):
+
+    extension = image_format(path, format)
+
+    if conversion is not None:
+        image = cv2.cvtColor(image, conversion)
+
+    try:
+        encoded, data = cv2.imencode(extension, image, encode_parameters(extension, quality, compression, progressive))
+    except cv2.error:
+        encoded = False  # no encoder for the extension
+    if not encoded:
+        raise IOError("could not encode image '%s' as %s" % (path, extension))
+
+    partial_path = path + '.partial'
+    try:
+        with open(partial_path, 'wb') as partial_file:
+            partial_file.write(data)
+        os.replace(partial_path, path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+
+# image waiting to be written
+class PendingExport(object):
+
+    def __init__(self, path, image, options, callback):
+        self.path = path
+        self.image = image  # released once written
+        self.options = options  # keyword arguments of write_image
+        self.callback = callback  # function called on the writer thread as callback(path, error)
+
+        self.error = None  # error message, None on success
+        self.done = threading.Event()
+
+
+# class writing images on a single background thread in the order they were submitted
+class ImageWriter(object):
+
+    def __init__(self):
+        self.queue = queue.Queue()  # exports not yet written, None stops the thread
+        self.pending = []  # exports not yet written, oldest first
+        self.lock = threading.Lock()
+        self.thread = None  # writer thread, started on first use
+
+    # queueing image to be written to path and returning its export, options are keyword arguments of write_image
+    # callback(path, error) is called on the writer thread when it is written, error is None on success
+    def submit(self, image, path, callback=None, **options):
+
+        export = PendingExport(path, image, options, callback)
+
+        with self.lock:
+            self.pending.append(export)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.queue.put(export)  # queued under the lock so exports of different threads keep their order
+
+        return export
+
+    # checking if an export not yet written holds the image passed (the same array, not a copy)
+    def holds(self, image):
+        with self.lock:
+            return any(export.image is image for export in self.pending)
+
+    # no. of exports not yet written
+    def pending_count(self):
+        with self.lock:
+            return len(self.pending)
+
+    # waiting until all exports submitted so far are written
+    def wait(self):
+        self.queue.join()
+
+    # writing the remaining exports and stopping the writer thread
+    def close(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+
+    def run(self):
+        while True:
+            export = self.queue.get()
+            if export is None:
+                self.queue.task_done()
+                return
+
+            try:
+                write_image(export.path, export.image, **export.options)
+            except Exception as error:
+                export.error = str(error) or type(error).__name__
+
+            with self.lock:
+                self.pending.remove(export)
+                export.image = None
+
+            try:
+                if export.callback is not None:
+                    export.callback(export.path, export.error)
+            finally:
+                export.done.set()
+                self.queue.task_done()